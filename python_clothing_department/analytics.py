@@ -0,0 +1,186 @@
+import json
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import data_persistence
+
+# ============================
+# SALES ANALYTICS
+# ============================
+# Orders and order items are encoded once into integer columns (interned
+# member, tier, SKU and status codes). Every grouped figure is then a
+# bincount over those columns, so the work per record is a single pass
+# instead of a Python-level join per order. NumPy does the grouping when it
+# is installed; otherwise the same columns are summed with plain loops.
+
+PAID = "PAID"
+RETURN = "RETURN"
+GUEST = "GUEST"
+
+
+# class Codes
+class Codes:
+    """Interns string keys as 0, 1, 2, ..."""
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def code(self, name):
+        code = self.ids.get(name)
+        if code is None:
+            code = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def __len__(self):
+        return len(self.names)
+
+
+# class SalesColumns
+class SalesColumns:
+    def __init__(self, orders, order_items, customers, product_variants):
+        self.members = Codes()
+        self.tiers = Codes()
+        self.statuses = Codes()
+        self.skus = Codes()
+        tier_of = {member_id: c.get("tier", "NONE") for member_id, c in customers.items()}
+
+        self.order_member = array("q")
+        self.order_tier = array("q")
+        self.order_status = array("q")
+        self.order_total = array("q")
+        order_row = {}
+        for o in orders:
+            member_id = o.get("member_id") or GUEST
+            order_row[o["id"]] = len(self.order_total)
+            self.order_member.append(self.members.code(member_id))
+            self.order_tier.append(self.tiers.code(tier_of.get(member_id, GUEST)))
+            self.order_status.append(self.statuses.code(o["status"]))
+            self.order_total.append(o["total_cents"])
+
+        # Items of unknown orders are skipped rather than failing the report
+        self.item_order = array("q")
+        self.item_sku = array("q")
+        self.item_qty = array("q")
+        self.item_revenue = array("q")
+        for item in order_items:
+            row = order_row.get(item["order_id"])
+            if row is None:
+                continue
+            price = product_variants.get(item["sku"], {}).get("price_cents", 0)
+            self.item_order.append(row)
+            self.item_sku.append(self.skus.code(item["sku"]))
+            self.item_qty.append(item["qty"])
+            self.item_revenue.append(item["qty"] * price)
+
+        if np is not None:
+            for name in ("order_member", "order_tier", "order_status", "order_total",
+                         "item_order", "item_sku", "item_qty", "item_revenue"):
+                setattr(self, name, np.frombuffer(getattr(self, name), dtype=np.int64))
+
+    def status_code(self, status):
+        return self.statuses.ids.get(status, -1)
+
+
+def _take(values, index):
+    if np is not None:
+        return values[index]
+    return [values[i] for i in index]
+
+
+def _only(keys, code, weights):
+    """weights where keys == code, zero elsewhere."""
+    if np is not None:
+        return weights * (keys == code)
+    return [w if k == code else 0 for k, w in zip(keys, weights)]
+
+
+def _group_sum(keys, weights, size):
+    if np is not None:
+        if not len(keys):
+            return [0] * size
+        return [int(round(v)) for v in np.bincount(keys, weights=weights, minlength=size)]
+    sums = [0] * size
+    for k, w in zip(keys, weights):
+        sums[k] += w
+    return sums
+
+
+def _ones(n):
+    if np is not None:
+        return np.ones(n, dtype=np.int64)
+    return [1] * n
+
+
+def _grouped(codes, columns):
+    """Turn {figure: [value per code]} into {name: {figure: value}}."""
+    return {name: {figure: values[i] for figure, values in columns.items()} for i, name in enumerate(codes.names)}
+
+
+# summarize(orders, order_items, customers, product_variants, top=10) -> dict
+def summarize(orders, order_items, customers, product_variants, top=10):
+    """Revenue and units by SKU, member, tier and status, plus top sellers.
+
+    SKU revenue is qty * catalog price; member, tier and status figures use
+    order totals, so they include loyalty discounts.
+    """
+    cols = SalesColumns(orders, order_items, customers, product_variants)
+    paid = cols.status_code(PAID)
+    returned = cols.status_code(RETURN)
+    n_orders = len(cols.order_total)
+    item_status = _take(cols.order_status, cols.item_order)
+
+    by_sku = {
+        "units_sold": _group_sum(cols.item_sku, _only(item_status, paid, cols.item_qty), len(cols.skus)),
+        "revenue_cents": _group_sum(cols.item_sku, _only(item_status, paid, cols.item_revenue), len(cols.skus)),
+        "units_returned": _group_sum(cols.item_sku, _only(item_status, returned, cols.item_qty), len(cols.skus)),
+    }
+    paid_totals = _only(cols.order_status, paid, cols.order_total)
+    refund_totals = _only(cols.order_status, returned, cols.order_total)
+    paid_counts = _only(cols.order_status, paid, _ones(n_orders))
+    by_member = {
+        "orders": _group_sum(cols.order_member, paid_counts, len(cols.members)),
+        "revenue_cents": _group_sum(cols.order_member, paid_totals, len(cols.members)),
+        "refunds_cents": _group_sum(cols.order_member, refund_totals, len(cols.members)),
+    }
+    by_tier = {
+        "orders": _group_sum(cols.order_tier, paid_counts, len(cols.tiers)),
+        "revenue_cents": _group_sum(cols.order_tier, paid_totals, len(cols.tiers)),
+        "refunds_cents": _group_sum(cols.order_tier, refund_totals, len(cols.tiers)),
+    }
+    by_status = {
+        "orders": _group_sum(cols.order_status, _ones(n_orders), len(cols.statuses)),
+        "total_cents": _group_sum(cols.order_status, cols.order_total, len(cols.statuses)),
+        "units": _group_sum(item_status, cols.item_qty, len(cols.statuses)),
+    }
+
+    units = by_sku["units_sold"]
+    ranked = sorted(range(len(units)), key=lambda i: (-units[i], cols.skus.names[i]))[:top]
+    status_totals = by_status["total_cents"]
+    revenue = status_totals[paid] if paid >= 0 else 0
+    refunds = status_totals[returned] if returned >= 0 else 0
+    return {
+        "order_count": n_orders,
+        "item_count": len(cols.item_qty),
+        "revenue_cents": revenue,
+        "refunds_cents": refunds,
+        "net_revenue_cents": revenue - refunds,
+        "top_sellers": [{"sku": cols.skus.names[i], "units_sold": units[i],
+                         "revenue_cents": by_sku["revenue_cents"][i]} for i in ranked if units[i]],
+        "by_sku": _grouped(cols.skus, by_sku),
+        "by_member": _grouped(cols.members, by_member),
+        "by_tier": _grouped(cols.tiers, by_tier),
+        "by_status": _grouped(cols.statuses, by_status),
+    }
+
+
+def export_sales_report(orders, order_items, customers, product_variants, filename="sales_report.json", top=10):
+    report = summarize(orders, order_items, customers, product_variants, top)
+    with open(data_persistence.ensure_data_dir() / filename, "w") as f:
+        json.dump(report, f, indent=2)
+    return report
@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import data_persistence
+import store_system
+from sharded_inventory import ShardedInventory
+from store_system import BronzeReward, Customer, LoyaltyProgram, Order
+
+# ============================
+# STORE ENGINE BENCHMARKS
+# ============================
+# Builds a synthetic store at each requested scale (number of movements,
+# orders and loyalty orders), times the hot operations against it and writes
+# the results as JSON. Compare two result files with --compare to spot
+# regressions between versions. Stock removals are also timed against a
+# ShardedInventory for each --shards count, against the in-process ledger.
+#
+#   python benchmark.py --scales 1000 10000 100000 --output bench.json
+#   python benchmark.py --scales 1000 10000 --compare bench.json
+#   python benchmark.py --scales 100000 --shards 1 2 4 8
+
+
+# generate_store(scale, seed) -> None
+def generate_store(scale, seed=0, skus_per_record=0.01, customers_per_record=0.05):
+    """Replace the store_system collections with a synthetic store of `scale` records."""
+    rng = random.Random(seed)
+    sku_count = max(10, int(scale * skus_per_record))
+    customer_count = max(10, int(scale * customers_per_record))
+
+    store_system.product_variants.clear()
+    for i in range(sku_count):
+        sku = f"SKU-{i:07d}"
+        store_system.product_variants[sku] = {"sku": sku, "price_cents": rng.randrange(500, 10000), "active": True}
+    skus = list(store_system.product_variants)
+
+    store_system.customers.clear()
+    for i in range(customer_count):
+        member_id = f"CUST{i:07d}"
+        store_system.customers[member_id] = {"member_id": member_id, "name": f"Customer {i}",
+                                             "tier": rng.choice(["NONE", "SILVER", "GOLD"]), "points": 0}
+    member_ids = list(store_system.customers)
+
+    # Every SKU gets a large receipt, then the history is random sales
+    store_system.inventory_movements.clear()
+    store_system.inventory_movements.extend({"sku": sku, "qty_change": scale} for sku in skus)
+    store_system.inventory_movements.extend({"sku": rng.choice(skus), "qty_change": -rng.randrange(1, 4)}
+                                            for _ in range(scale))
+
+    store_system.orders.clear()
+    store_system.order_items.clear()
+    store_system.orders.extend({"id": i, "order_code": store_system.generate_order_code(i),
+                                "member_id": rng.choice(member_ids), "status": "PAID",
+                                "total_cents": rng.randrange(500, 50000)} for i in range(1, scale + 1))
+    store_system.order_items.extend({"id": i, "order_id": i, "sku": rng.choice(skus), "qty": rng.randrange(1, 4)}
+                                    for i in range(1, scale + 1))
+    return skus, member_ids
+
+
+# measure(fn, iterations, units=1) -> dict
+def measure(fn, iterations, units=1):
+    """Time `iterations` calls of fn(i); each call does `units` operations."""
+    started = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    seconds = time.perf_counter() - started
+    iterations *= units
+    return {
+        "iterations": iterations,
+        "seconds": seconds,
+        "ops_per_s": iterations / seconds if seconds else float("inf"),
+        "us_per_op": seconds / iterations * 1e6,
+    }
+
+
+# measure_removals(ledger, carts, batch_size) -> {op: stats}
+def measure_removals(ledger, carts, batch_size=100):
+    """Time two-SKU cart removals one at a time and in batches."""
+    batches = [carts[i:i + batch_size] for i in range(0, len(carts) - batch_size + 1, batch_size)]
+    return {
+        "remove_many": measure(lambda i: ledger.remove_many(carts[i]), len(carts)),
+        "remove_batch": measure(lambda i: ledger.remove_batch(batches[i]), len(batches), batch_size),
+    }
+
+
+# run_scale(scale, iterations, seed, shard_counts) -> list of results
+def run_scale(scale, iterations=1000, seed=0, shard_counts=()):
+    rng = random.Random(seed)
+    skus, member_ids = generate_store(scale, seed)
+    iterations = min(iterations, scale)
+    results = {}
+
+    results["scan_item"] = measure(lambda i: store_system.scan_item([], rng.choice(skus)), iterations)
+    results["calculate_stock_level"] = measure(lambda i: store_system.calculate_stock_level(rng.choice(skus)),
+                                               iterations)
+
+    def sale(i):
+        sku = rng.choice(skus)
+        store_system.finalize_sale([{"sku": sku, "price_cents": 1000, "qty": 1}], rng.choice(member_ids))
+    results["finalize_sale"] = measure(sale, iterations)
+
+    def give_back(i):
+        item = store_system.order_items[i]
+        store_system.process_return(item["order_id"], [{"sku": item["sku"], "qty": 1}])
+    results["process_return"] = measure(give_back, iterations)
+
+    program = LoyaltyProgram(BronzeReward())
+    for n, member_id in enumerate(member_ids, start=1):
+        program.add_customer(Customer(n, member_id, f"Customer {n}", "Bronze", 0))
+    for order in store_system.orders[:scale]:
+        program.add_order(Order(order["id"], order["order_code"], order["member_id"], "Delivered",
+                                order["total_cents"]))
+    codes = list(program.orders)
+    results["apply_points"] = measure(lambda i: program.apply_points(codes[i]), iterations)
+
+    carts = [dict.fromkeys(rng.sample(skus, 2), 1) for _ in range(iterations)]
+    for op, stats in measure_removals(store_system.inventory_movements, carts).items():
+        results[op] = stats
+    for shards in shard_counts:
+        with ShardedInventory(store_system.inventory_movements, shards=shards) as engine:
+            for op, stats in measure_removals(engine, carts).items():
+                results[f"sharded{shards}.{op}"] = stats
+
+    saved_dir = data_persistence.data_dir
+    with tempfile.TemporaryDirectory() as tmp:
+        data_persistence.set_data_dir(tmp)
+        try:
+            collections = (store_system.inventory_movements, store_system.customers,
+                           store_system.orders, store_system.order_items)
+            results["save_all"] = measure(lambda i: data_persistence.save_all(*collections), 1)
+            results["load_all"] = measure(lambda i: data_persistence.load_all(), 1)
+        finally:
+            data_persistence.set_data_dir(saved_dir)
+
+    return [dict(scale=scale, op=op, **stats) for op, stats in results.items()]
+
+
+def compare(results, baseline):
+    """Print the ops/s ratio of each result against a previous run."""
+    before = {(r["scale"], r["op"]): r["ops_per_s"] for r in baseline["results"]}
+    for r in results:
+        old = before.get((r["scale"], r["op"]))
+        if old:
+            ratio = r["ops_per_s"] / old
+            flag = "  <-- slower" if ratio < 0.9 else ""
+            print(f"{r['op']:>22} @ {r['scale']:>9}: {ratio:6.2f}x{flag}")
+
+
+def print_table(results):
+    print(f"{'op':>22} {'scale':>9} {'ops/s':>14} {'us/op':>12}")
+    for r in results:
+        print(f"{r['op']:>22} {r['scale']:>9} {r['ops_per_s']:>14.0f} {r['us_per_op']:>12.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the store engine at increasing scales.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="records per collection, e.g. 1000 10000 ... 10000000")
+    parser.add_argument("--iterations", type=int, default=1000, help="timed calls per operation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shards", type=int, nargs="*", default=[os.cpu_count() or 1],
+                        help="worker counts to time ShardedInventory with; none to skip")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="previous JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    results = []
+    for scale in args.scales:
+        results.extend(run_scale(scale, args.iterations, args.seed, args.shards))
+    print_table(results)
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": args.iterations,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    return report
+
+
+if __name__ == "__main__":
+    main()
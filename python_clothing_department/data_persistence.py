@@ -1,63 +1,482 @@
 import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+from instrumentation import count, emit, timed
+
 # ============================
 # DATA PERSISTENCE FUNCTIONS
 # ============================
 
+# Lazy collection handles, reset whenever the stored data changes underneath them
+_lazy_handles = []
+
+def invalidate():
+    """Drop every cached lazy collection; the next access reloads it."""
+    for handle in _lazy_handles:
+        handle.reset()
+
 # Define paths
-data_dir = Path("data")
-data_dir.mkdir(exist_ok=True)
+def set_data_dir(path):
+    """Point every data file at `path`. The directory is created by the first write."""
+    global data_dir, inventory_file, customers_file, orders_file, order_items_file
+    global inventory_journal, orders_journal, order_items_journal, inventory_archive, inventory_binary
+    data_dir = Path(path)
+
+    inventory_file = data_dir / "inventory.json"
+    customers_file = data_dir / "customers.json"
+    orders_file = data_dir / "orders.json"
+    order_items_file = data_dir / "order_items.json"
+
+    # Journals hold records appended since the last save_all
+    inventory_journal = data_dir / "inventory.jsonl"
+    orders_journal = data_dir / "orders.jsonl"
+    order_items_journal = data_dir / "order_items.jsonl"
+
+    # Movements folded away by compact_inventory
+    inventory_archive = data_dir / "inventory_archive.jsonl"
 
-inventory_file = data_dir / "inventory.json"
-customers_file = data_dir / "customers.json"
-orders_file = data_dir / "orders.json"
-order_items_file = data_dir / "order_items.json"
+    # Fixed-width movement records, see movement_store.BinaryMovementFile
+    inventory_binary = data_dir / "inventory.bin"
+    invalidate()
 
-# Save helper
+def ensure_data_dir():
+    data_dir.mkdir(parents=True, exist_ok=True)
+    return data_dir
+
+set_data_dir("data")
+
+logger = logging.getLogger("data_persistence")
+
+# Error reporting helper: failures always reach the log (stderr when logging
+# is not configured), not only the optional event sink
+def report_error(action, file_path, e):
+    count("persistence_errors")
+    logger.error("Error %s %s: %s", action, file_path, e)
+    emit("persistence.error", "Error {action} {file_path}: {error}", action=action, file_path=file_path, error=e)
+
+# Atomic write helper: write(f) fills a temp file that then replaces
+# file_path, so a crash or error never leaves a half-written file behind
+def replace_file(file_path, write):
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = file_path.with_name(file_path.name + ".tmp")
+    try:
+        with open(tmp, "w") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, file_path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+# Save helper: returns False (after reporting) when the write failed
+@timed("save_data")
 def save_data(data, file_path):
     try:
-        with open(file_path, "w") as f:
-            json.dump(data, f, indent=2)
-        print(f"Saved to {file_path}")
+        replace_file(file_path, lambda f: json.dump(data, f, indent=2))
+        emit("persistence.saved", "Saved to {file_path}", file_path=file_path)
+        return True
     except Exception as e:
-        print(f"Error saving to {file_path}: {e}")
+        report_error("saving to", file_path, e)
+        return False
 
 # Load helper
+@timed("load_data")
 def load_data(file_path, default):
     try:
         if file_path.exists():
             with open(file_path, "r") as f:
                 return json.load(f)
     except Exception as e:
-        print(f"Error loading from {file_path}: {e}")
+        report_error("loading from", file_path, e)
     return default
 
-# Save all data
+# Streaming load helper: yields the items of a top-level JSON array, or the
+# (key, value) pairs of a top-level object, reading the file in chunks
+def iter_data(file_path, chunk_size=1 << 16, strict=False):
+    try:
+        if file_path.exists():
+            with open(file_path, "r") as f:
+                yield from _iter_json_container(f, chunk_size)
+    except Exception as e:
+        if strict:
+            raise
+        report_error("loading from", file_path, e)
+
+def _iter_json_container(f, chunk_size):
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def skip(chars):
+        # Advance past the given characters, reading more input as needed
+        nonlocal buffer, pos, eof
+        while True:
+            while pos < len(buffer) and buffer[pos] in chars:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            buffer, pos = f.read(chunk_size), 0
+            eof = not buffer
+
+    def value():
+        # Decode one JSON value; a value that reaches the end of the buffer
+        # may be cut short, so it only counts once more input follows it
+        nonlocal buffer, pos, eof
+        while True:
+            try:
+                result, end = decoder.raw_decode(buffer, pos)
+                if end < len(buffer) or eof:
+                    pos = end
+                    return result
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+
+    skip(" \t\r\n")
+    if eof:
+        return
+    opening = buffer[pos]
+    if opening not in "[{":
+        raise ValueError(f"Expected a JSON array or object, found {opening!r}")
+    closing = "]" if opening == "[" else "}"
+    pos += 1
+    while True:
+        skip(" \t\r\n,")
+        if eof:
+            raise ValueError("Unexpected end of file")
+        if buffer[pos] == closing:
+            return
+        if opening == "[":
+            yield value()
+        else:
+            key = value()
+            skip(" \t\r\n:")
+            yield key, value()
+
+# Append helper: one JSON record per line, flushed before returning. A torn
+# final line left by an interrupted append is cut off first, so the new
+# records do not run on from it
+@timed("append_records")
+def append_records(records, file_path):
+    try:
+        with journal_lock(file_path), open(file_path, "ab+") as f:
+            _truncate_torn_tail(f, file_path)
+            f.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records).encode())
+            f.flush()
+    except Exception as e:
+        report_error("appending to", file_path, e)
+
+def _truncate_torn_tail(f, file_path):
+    end = pos = f.seek(0, os.SEEK_END)
+    while pos > 0:
+        start = max(pos - (1 << 12), 0)
+        f.seek(start)
+        chunk = f.read(pos - start)
+        if pos == end and chunk.endswith(b"\n"):
+            return
+        newline = chunk.rfind(b"\n")
+        if newline >= 0:
+            f.truncate(start + newline + 1)
+            break
+        pos = start
+    else:
+        f.truncate(0)
+    emit("persistence.partial_record", "Dropped a partial final record in {file_path}", file_path=file_path)
+
+# Journal streaming helper: yields one record per line. A torn final line
+# from an interrupted append is dropped; a corrupt line anywhere else is
+# reported and skipped, or raised when strict
+def iter_journal(file_path, strict=False):
+    try:
+        if file_path.exists():
+            with open(file_path, "r") as f:
+                bad = None
+                for number, line in enumerate(f, start=1):
+                    if not line.strip():
+                        continue
+                    if bad is not None:
+                        _corrupt_line(file_path, *bad, strict)
+                        bad = None
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError as e:
+                        bad = (number, e)
+                        continue
+                    yield record
+                if bad is not None:
+                    emit("persistence.partial_record", "Dropped a partial final record in {file_path}",
+                         file_path=file_path)
+    except Exception as e:
+        if strict:
+            raise
+        report_error("loading from", file_path, e)
+
+def _corrupt_line(file_path, number, error, strict):
+    if strict:
+        raise ValueError(f"Corrupt record at line {number} of {file_path}: {error}")
+    count("journal_corrupt_records")
+    report_error(f"skipping line {number} of", file_path, error)
+
+# Journal load helper
+def load_journal(file_path):
+    return list(iter_journal(file_path))
+
+# Journal one sale or return; cost does not depend on stored history
+def save_sale(order, order_items, inventory_movements):
+    append_records(inventory_movements, inventory_journal)
+    append_records(order_items, order_items_journal)
+    append_records([order], orders_journal)
+    invalidate()
+
+# Save all data (a full snapshot, so the journals start over)
+@timed("save_all")
 def save_all(inventory_movements, customers, orders, order_items):
-    save_data(inventory_movements, inventory_file)
-    save_data(customers, customers_file)
-    save_data(orders, orders_file)
-    save_data(order_items, order_items_file)
+    saved = [save_data(inventory_movements, inventory_file),
+             save_data(customers, customers_file),
+             save_data(orders, orders_file),
+             save_data(order_items, order_items_file)]
+    # The journals are only redundant once every snapshot is on disk
+    if all(saved):
+        for journal in (inventory_journal, orders_journal, order_items_journal):
+            journal.unlink(missing_ok=True)
+    invalidate()
+    return all(saved)
+
+# Per-collection loaders: the last snapshot plus anything journaled since
+def load_inventory():
+    return load_data(inventory_file, []) + load_journal(inventory_journal)
+
+def load_customers():
+    return load_data(customers_file, {})
+
+def load_orders():
+    return load_data(orders_file, []) + load_journal(orders_journal)
+
+def load_order_items():
+    return load_data(order_items_file, []) + load_journal(order_items_journal)
 
 # Load all data
+@timed("load_all")
 def load_all():
-    inventory_movements = load_data(inventory_file, [])
-    customers = load_data(customers_file, {})
-    orders = load_data(orders_file, [])
-    order_items = load_data(order_items_file, [])
-    return inventory_movements, customers, orders, order_items
+    return load_inventory(), load_customers(), load_orders(), load_order_items()
+
+# class LazyCollection
+class LazyCollection:
+    """Loads one collection on first access and keeps it until invalidate()."""
+
+    def __init__(self, loader):
+        self.loader = loader
+        self._value = None
+        self.loaded = False
+        _lazy_handles.append(self)
+
+    @property
+    def value(self):
+        if not self.loaded:
+            self._value = self.loader()
+            self.loaded = True
+        return self._value
+
+    def reset(self):
+        self._value = None
+        self.loaded = False
+
+    def __len__(self):
+        return len(self.value)
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __getitem__(self, key):
+        return self.value[key]
+
+    def __contains__(self, key):
+        return key in self.value
+
+# Lazy handles for processes that only need some of the data, e.g.
+# `data_persistence.lazy_customers["CUST123"]` parses customers.json alone
+lazy_inventory = LazyCollection(load_inventory)
+lazy_customers = LazyCollection(load_customers)
+lazy_orders = LazyCollection(load_orders)
+lazy_order_items = LazyCollection(load_order_items)
+
+# Compaction: fold all but the last `keep` stored movements into one snapshot
+# row per SKU, so loading inventory costs O(SKUs + tail) instead of O(history).
+# Any unreadable record or failed write raises and leaves the stored files as
+# they were; the journal is only removed once the new snapshot is in place.
+# Appends wait on the journal lock until then, so none fall between the fold
+# and the unlink.
+def compact_inventory(keep=0):
+    with journal_lock(inventory_journal):
+        pending = _compact_inventory(keep)
+    invalidate()
+    with open(pending) as src, open(inventory_archive, "a") as dst:
+        shutil.copyfileobj(src, dst)
+    pending.unlink()
+
+def _compact_inventory(keep):
+    baseline = {}
+    as_of = [0.0]
+    last_seq = [-1]
+    tail = deque(maxlen=keep) if keep > 0 else None
+    pending = inventory_archive.with_name(inventory_archive.name + ".tmp")
+
+    try:
+        with open(pending, "w") as archive:
+            def fold(movement):
+                baseline[movement["sku"]] = baseline.get(movement["sku"], 0) + movement["qty_change"]
+                as_of[0] = max(as_of[0], movement.get("ts", as_of[0]))
+                last_seq[0] = max(last_seq[0], movement.get("seq", -1))
+                if not movement.get("snapshot"):
+                    archive.write(json.dumps(movement, separators=(",", ":")) + "\n")
+
+            for source in (iter_data(inventory_file, strict=True), iter_journal(inventory_journal, strict=True)):
+                for movement in source:
+                    if tail is not None:
+                        if len(tail) == keep:
+                            fold(tail[0])
+                        tail.append(movement)
+                    else:
+                        fold(movement)
+        snapshot = [{"sku": sku, "qty_change": qty, "snapshot": True, "ts": as_of[0]}
+                    for sku, qty in baseline.items() if qty]
+        if last_seq[0] >= 0:
+            for row in snapshot:
+                row["seq"] = last_seq[0]
+        replace_file(inventory_file, lambda f: json.dump(snapshot + list(tail or ()), f, indent=2))
+    except BaseException:
+        pending.unlink(missing_ok=True)
+        raise
+    inventory_journal.unlink(missing_ok=True)
+    return pending
+
+# Exclusive lock on an open file, shared with other processes (flock on POSIX,
+# a one-byte region lock on Windows)
+@contextmanager
+def exclusive_lock(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield f
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+    elif msvcrt is not None:
+        fd = f.fileno()
+        while True:
+            os.lseek(fd, 0, os.SEEK_SET)
+            try:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                time.sleep(0.01)
+        try:
+            yield f
+        finally:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        raise RuntimeError("No file locking available on this platform")
+
+# Journal lock: a <journal>.lock file next to the journal, which (unlike the
+# journal itself) is never unlinked, so every writer locks the same file
+@contextmanager
+def journal_lock(file_path):
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(file_path.with_name(file_path.name + ".lock"), "a") as f, exclusive_lock(f):
+        yield
+
+# Id sequences: <name>.seq holds the next free id as a fixed-width number,
+# rewritten in place under an exclusive file lock
+def lease_ids(name, count, floor=1):
+    """Reserve `count` consecutive ids from sequence `name`; returns the first."""
+    fd = os.open(ensure_data_dir() / f"{name}.seq", os.O_RDWR | os.O_CREAT, 0o644)
+    with os.fdopen(fd, "r+") as f, exclusive_lock(f):
+        text = f.read().strip()
+        first = max(int(text) if text else 1, floor)
+        f.seek(0)
+        f.write(f"{first + count:020d}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    return first
+
+# class BlockIdSource
+class BlockIdSource:
+    """Hands out ids from blocks leased from a shared sequence, so several
+    processes can number orders without talking to each other per sale.
+    Ids are unique across writers and increasing within each one. Orders and
+    their items each need a sequence; an allocator without one numbers rows
+    len + 1, which is only unique within one writer:
+
+        store_system.order_ids.source = BlockIdSource("orders", floor=len(store_system.orders) + 1)
+        store_system.order_item_ids.source = BlockIdSource("order_items", floor=len(store_system.order_items) + 1)
+    """
+
+    def __init__(self, name, block_size=1000, floor=1):
+        self.name = name
+        self.block_size = block_size
+        self.floor = floor
+        self.next_id = 0
+        self.end = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            if self.next_id >= self.end:
+                self.next_id = lease_ids(self.name, self.block_size, self.floor)
+                self.end = self.next_id + self.block_size
+            self.next_id += 1
+            return self.next_id - 1
+
+# Stock rebuild: fold the stored movements into per-SKU totals
+def load_stock_levels():
+    stock = {}
+    for source in (iter_data(inventory_file), iter_journal(inventory_journal)):
+        for movement in source:
+            stock[movement["sku"]] = stock.get(movement["sku"], 0) + movement["qty_change"]
+    return stock
 
+# Works with loaded collections or with the iter_data/iter_journal streams
 def export_summary(customers, orders, inventory_movements, filename="summary_report.json"):
     try:
+        if isinstance(customers, dict):
+            customer_ids = list(customers.keys())
+        else:
+            customer_ids = [member_id for member_id, _ in customers]
+        order_count = 0
+        total_revenue_cents = 0
+        for o in orders:
+            order_count += 1
+            total_revenue_cents += o["total_cents"]
         summary = {
-            "inventory_count": len(inventory_movements),
-            "customer_ids": list(customers.keys()),
-            "order_count": len(orders),
-            "total_revenue_cents": sum(o["total_cents"] for o in orders)
+            "inventory_count": sum(1 for _ in inventory_movements),
+            "customer_ids": customer_ids,
+            "order_count": order_count,
+            "total_revenue_cents": total_revenue_cents
         }
-        with open(data_dir / filename, "w") as f:
+        with open(ensure_data_dir() / filename, "w") as f:
             json.dump(summary, f, indent=2)
-        print(f"Exported summary to {filename}")
+        emit("persistence.exported", "Exported summary to {filename}", filename=filename)
     except Exception as e:
-        print(f"Error exporting report: {e}")
+        report_error("exporting", filename, e)
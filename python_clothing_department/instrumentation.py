@@ -0,0 +1,133 @@
+import bisect
+import functools
+import json
+import threading
+import time
+
+# ============================
+# EVENTS AND METRICS
+# ============================
+# Store and persistence code reports through emit() instead of print(). The
+# sink is None by default, so events cost one check and no formatting. Set
+# print_sink to get the old console output back, or any callable taking
+# (event, template, fields) to route events elsewhere.
+
+_sink = None
+_lock = threading.Lock()
+
+counters = {}
+histograms = {}
+started_at = time.time()
+
+
+def set_sink(sink):
+    global _sink
+    _sink = sink
+
+
+def print_sink(event, template, fields):
+    print(template.format(**fields))
+
+
+def emit(event, template, **fields):
+    if _sink is not None:
+        _sink(event, template, fields)
+
+
+# class LatencyHistogram
+class LatencyHistogram:
+    """Log-bucketed latency histogram from 1 microsecond to about 100 seconds.
+
+    Each bucket is 2 ** 0.25 (about 19%) wider than the last, which bounds the
+    error of a reported percentile to one bucket.
+    """
+
+    bounds = [1e-6 * 2 ** (i / 4) for i in range(108)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        i = bisect.bisect_left(self.bounds, seconds)
+        with _lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile, in seconds."""
+        if not self.count:
+            return 0.0
+        rank = max(1, round(self.count * p / 100))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "p50_ms": self.percentile(50) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+
+def count(name, n=1):
+    with _lock:
+        counters[name] = counters.get(name, 0) + n
+
+
+def observe(name, seconds):
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms.setdefault(name, LatencyHistogram())
+    histogram.record(seconds)
+
+
+def timed(name):
+    """Decorator recording each call's wall time in the `name` histogram."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+def reset():
+    global started_at
+    with _lock:
+        counters.clear()
+        histograms.clear()
+        started_at = time.time()
+
+
+def snapshot():
+    """Counters, per-second rates and latency percentiles since the last reset."""
+    elapsed = max(time.time() - started_at, 1e-9)
+    with _lock:
+        counter_values = dict(counters)
+    return {
+        "elapsed_s": elapsed,
+        "counters": counter_values,
+        "rates_per_s": {name: value / elapsed for name, value in counter_values.items()},
+        "latency": {name: histogram.snapshot() for name, histogram in list(histograms.items())},
+    }
+
+
+def export_snapshot(file_path):
+    with open(file_path, "w") as f:
+        json.dump(snapshot(), f, indent=2)
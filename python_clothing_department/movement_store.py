@@ -0,0 +1,274 @@
+import mmap
+import struct
+import time
+from array import array
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import data_persistence
+from store_system import InventoryMovement
+
+# ============================
+# COLUMNAR MOVEMENT STORAGE
+# ============================
+# Each movement is an (id, sku, qty_change) triple. Instead of one dict or
+# object per movement, the store keeps three flat arrays and interns SKU
+# strings as small ints, which is 16 bytes per movement.
+
+
+# class MovementRow
+class MovementRow(InventoryMovement):
+    """Read-only InventoryMovement view of one row in a MovementColumns store."""
+
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    @property
+    def _id(self):
+        return self._store.ids[self._index]
+
+    @property
+    def _sku(self):
+        return self._store.sku_codes[self._store.sku_col[self._index]]
+
+    @property
+    def _qty_change(self):
+        return self._store.qty_col[self._index]
+
+    @property
+    def id(self):
+        return self._id
+
+
+# class MovementColumns
+class MovementColumns:
+    def __init__(self, movements=()):
+        self.sku_codes = []
+        self.sku_ids = {}
+        self.ids = array("q")
+        self.sku_col = array("i")
+        self.qty_col = array("i")
+        for movement in movements:
+            self.append_movement(movement)
+
+    def intern(self, sku):
+        sku_id = self.sku_ids.get(sku)
+        if sku_id is None:
+            sku_id = len(self.sku_codes)
+            self.sku_ids[sku] = sku_id
+            self.sku_codes.append(sku)
+        return sku_id
+
+    def append(self, sku, qty_change, id=None):
+        if not sku or not isinstance(qty_change, int):
+            raise ValueError("Invalid inventory movement data")
+        if id is None:
+            id = len(self.ids) + 1
+        self.ids.append(id)
+        self.sku_col.append(self.intern(sku))
+        self.qty_col.append(qty_change)
+        return id
+
+    # Accepts the dict rows used by store_system or InventoryMovement objects
+    def append_movement(self, movement):
+        if isinstance(movement, dict):
+            return self.append(movement["sku"], movement["qty_change"], movement.get("id"))
+        return self.append(movement.sku, movement.qty_change, getattr(movement, "_id", None))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.ids)
+        if not 0 <= index < len(self.ids):
+            raise IndexError("movement index out of range")
+        return MovementRow(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.ids)):
+            yield MovementRow(self, index)
+
+    def totals(self):
+        """Return {sku: on-hand total} summed over every movement."""
+        if np is not None and len(self.ids):
+            skus = np.frombuffer(self.sku_col, dtype=np.intc)
+            qty = np.frombuffer(self.qty_col, dtype=np.intc)
+            sums = np.bincount(skus, weights=qty, minlength=len(self.sku_codes))
+            return {sku: int(round(total)) for sku, total in zip(self.sku_codes, sums)}
+        sums = [0] * len(self.sku_codes)
+        for sku_id, qty_change in zip(self.sku_col, self.qty_col):
+            sums[sku_id] += qty_change
+        return dict(zip(self.sku_codes, sums))
+
+    def on_hand(self, sku):
+        sku_id = self.sku_ids.get(sku)
+        if sku_id is None:
+            return 0
+        if np is not None:
+            skus = np.frombuffer(self.sku_col, dtype=np.intc)
+            qty = np.frombuffer(self.qty_col, dtype=np.intc)
+            return int(qty[skus == sku_id].sum())
+        return sum(q for s, q in zip(self.sku_col, self.qty_col) if s == sku_id)
+
+
+# ============================
+# BINARY MOVEMENT FILE
+# ============================
+# Movements appended as fixed-width little-endian records:
+#   int32 sku id | int32 qty change | float64 timestamp
+# SKU ids index a sidecar text file with one SKU per line, written before
+# any record that uses the id. Writers append under an exclusive lock on the
+# sidecar and re-read it first, so several writers agree on every id; readers
+# pick up new SKUs before each read. Reading maps the file and sums the
+# columns in place, so startup does no per-record parsing. A torn final
+# record (crash mid-append) is ignored.
+
+RECORD = struct.Struct("<iid")
+if np is not None:
+    RECORD_DTYPE = np.dtype([("sku", "<i4"), ("qty", "<i4"), ("ts", "<f8")])
+
+
+# class BinaryMovementFile
+class BinaryMovementFile:
+    def __init__(self, path=None):
+        self.path = Path(path or data_persistence.inventory_binary)
+        self.sku_path = self.path.with_suffix(".skus")
+        self.sku_codes = []
+        self.sku_ids = {}
+        self._sku_offset = 0
+        self._file = None
+        self._sku_file = None
+        self._refresh()
+
+    def _refresh(self):
+        # Read SKUs other writers added since the last call; a line still
+        # being written is left for next time
+        try:
+            with open(self.sku_path, "rb") as f:
+                f.seek(self._sku_offset)
+                text = f.read()
+        except FileNotFoundError:
+            return
+        complete = text.rfind(b"\n") + 1
+        for sku in text[:complete].decode().splitlines():
+            self.sku_ids[sku] = len(self.sku_codes)
+            self.sku_codes.append(sku)
+        self._sku_offset += complete
+
+    def _open(self):
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._sku_file = open(self.sku_path, "a")
+            self._file = open(self.path, "ab")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._sku_file.close()
+        self._file = None
+        self._sku_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def intern(self, sku):
+        sku_id = self.sku_ids.get(sku)
+        if sku_id is None:
+            sku_id = len(self.sku_codes)
+            line = sku + "\n"
+            self._sku_file.write(line)
+            self._sku_offset += len(line.encode())
+            self.sku_ids[sku] = sku_id
+            self.sku_codes.append(sku)
+        return sku_id
+
+    def append(self, sku, qty_change, ts=None):
+        self.extend([{"sku": sku, "qty_change": qty_change, "ts": ts}])
+
+    def extend(self, movements):
+        """Append movement dicts ({"sku", "qty_change", optional "ts"})."""
+        self._open()
+        now = time.time()
+        with data_persistence.exclusive_lock(self._sku_file):
+            self._refresh()
+            out = bytearray()
+            try:
+                for m in movements:
+                    sku, qty_change = m["sku"], m["qty_change"]
+                    if not sku or not isinstance(qty_change, int):
+                        raise ValueError("Invalid inventory movement data")
+                    ts = m.get("ts")
+                    out += RECORD.pack(self.intern(sku), qty_change, now if ts is None else ts)
+            finally:
+                self._sku_file.flush()
+            self._file.write(out)
+            self._file.flush()
+
+    def __len__(self):
+        if self._file is not None:
+            self._file.flush()
+        try:
+            return self.path.stat().st_size // RECORD.size
+        except FileNotFoundError:
+            return 0
+
+    def _fold(self, fold):
+        # fold(buffer, count) runs while the file is mapped; it must not
+        # keep references to the buffer
+        count = len(self)
+        # Every id in the first `count` records is in the sidecar by now
+        self._refresh()
+        if not count:
+            return fold(b"", 0)
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return fold(mapped, count)
+
+    def __iter__(self):
+        def rows(buffer, count):
+            return [{"sku": self.sku_codes[sku_id], "qty_change": qty_change, "ts": ts}
+                    for sku_id, qty_change, ts in RECORD.iter_unpack(buffer[:count * RECORD.size])]
+        return iter(self._fold(rows))
+
+    def totals(self):
+        """Return {sku: on-hand total} summed over every record."""
+        return self._totals()[0]
+
+    def _totals(self):
+        # ({sku: total}, newest record ts) in one pass over the mapped file
+        def fold(buffer, count):
+            if np is not None and count:
+                records = np.frombuffer(buffer, dtype=RECORD_DTYPE, count=count)
+                sums = np.bincount(records["sku"], weights=records["qty"], minlength=len(self.sku_codes))
+                latest = float(records["ts"].max())
+                del records
+                return [int(round(total)) for total in sums], latest
+            sums = [0] * len(self.sku_codes)
+            latest = 0.0
+            for sku_id, qty_change, ts in RECORD.iter_unpack(buffer[:count * RECORD.size]):
+                sums[sku_id] += qty_change
+                if ts > latest:
+                    latest = ts
+            return sums, latest
+        sums, latest = self._fold(fold)
+        return dict(zip(self.sku_codes, sums)), latest
+
+    def on_hand(self, sku):
+        return self.totals().get(sku, 0)
+
+    def snapshot_rows(self):
+        """Totals as the snapshot rows MovementLog.compact produces, stamped
+        with the newest record's ts, to seed store_system.inventory_movements
+        at startup."""
+        totals, latest = self._totals()
+        return [{"sku": sku, "qty_change": total, "snapshot": True, "ts": latest} for sku, total in totals.items()]
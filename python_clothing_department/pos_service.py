@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import json
+import time
+
+import data_persistence
+import store_system
+
+# ============================
+# POINT-OF-SALE SERVICE
+# ============================
+# Registers connect over a local socket and send one JSON request per line,
+# e.g. {"op": "scan", "sku": "SHIRT-RED-M"}. Each connection is one register
+# with its own cart. Responses come back one JSON object per line, in request
+# order, so a register may pipeline many requests before reading any replies.
+
+
+# class RegisterSession
+class RegisterSession:
+    def __init__(self, register_id):
+        self.register_id = register_id
+        self.cart = []
+
+
+# class PosServer
+class PosServer:
+    def __init__(self, host="127.0.0.1", port=0, path=None, persist=True):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.persist = persist
+        self.server = None
+        self.sessions = {}
+        self.pending = asyncio.Queue()
+        self.flusher = None
+        self.handlers = {
+            "open": self.op_open,
+            "scan": self.op_scan,
+            "cart": self.op_cart,
+            "clear": self.op_clear,
+            "finalize": self.op_finalize,
+            "return": self.op_return,
+            "stock": self.op_stock,
+        }
+
+    async def start(self):
+        if self.path:
+            self.server = await asyncio.start_unix_server(self.handle_register, path=self.path)
+        else:
+            self.server = await asyncio.start_server(self.handle_register, self.host, self.port)
+            self.port = self.server.sockets[0].getsockname()[1]
+        if self.persist:
+            self.flusher = asyncio.create_task(self.flush_forever())
+        return self
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        if self.flusher:
+            await self.pending.join()
+            self.flusher.cancel()
+
+    async def handle_register(self, reader, writer):
+        session = RegisterSession(f"REG-{id(writer)}")
+        self.sessions[session.register_id] = session
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write(self.dispatch(session, line))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.sessions.pop(session.register_id, None)
+            writer.close()
+
+    def dispatch(self, session, line):
+        try:
+            request = json.loads(line)
+            handler = self.handlers.get(request.get("op"))
+            if handler is None:
+                response = {"ok": False, "error": f"Unknown op {request.get('op')!r}"}
+            else:
+                response = handler(session, request)
+        except Exception as e:
+            response = {"ok": False, "error": str(e)}
+        return (json.dumps(response) + "\n").encode()
+
+    def op_open(self, session, request):
+        self.sessions.pop(session.register_id, None)
+        session.register_id = request.get("register_id", session.register_id)
+        self.sessions[session.register_id] = session
+        return {"ok": True, "register_id": session.register_id}
+
+    def op_scan(self, session, request):
+        store_system.scan_item(session.cart, request["sku"])
+        return {"ok": True, "cart": session.cart, "total_cents": store_system.calculate_cart_total(session.cart)}
+
+    def op_cart(self, session, request):
+        return {"ok": True, "cart": session.cart, "total_cents": store_system.calculate_cart_total(session.cart)}
+
+    def op_clear(self, session, request):
+        session.cart = []
+        return {"ok": True}
+
+    def op_finalize(self, session, request):
+        cart = session.cart
+        order, items = store_system.finalize_sale_with_items(cart, request.get("member_id"))
+        if order is None:
+            return {"ok": False, "error": "Sale could not be finalized."}
+        session.cart = []
+        self.queue_sale(order, items, cart, -1)
+        return {"ok": True, "order": order}
+
+    def op_return(self, session, request):
+        return_order, items = store_system.process_return_with_items(request["order_id"], request["items"])
+        if return_order is None:
+            return {"ok": False, "error": "Return is not eligible."}
+        self.queue_sale(return_order, items, request["items"], 1)
+        return {"ok": True, "order": return_order}
+
+    def op_stock(self, session, request):
+        return {"ok": True, "sku": request["sku"], "qty": store_system.calculate_stock_level(request["sku"])}
+
+    def queue_sale(self, order, items, lines, direction):
+        if not self.persist:
+            return
+        movements = [{"sku": line["sku"], "qty_change": direction * line["qty"], "ts": time.time()} for line in lines]
+        self.pending.put_nowait((order, items, movements))
+
+    async def flush_forever(self):
+        # Journal writes run in a worker thread so registers never wait on disk
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.pending.get()]
+            while not self.pending.empty():
+                batch.append(self.pending.get_nowait())
+            try:
+                await loop.run_in_executor(None, self.flush_batch, batch)
+            finally:
+                for _ in batch:
+                    self.pending.task_done()
+
+    @staticmethod
+    def flush_batch(batch):
+        data_persistence.append_records([m for _, _, movements in batch for m in movements],
+                                        data_persistence.inventory_journal)
+        data_persistence.append_records([i for _, items, _ in batch for i in items],
+                                        data_persistence.order_items_journal)
+        data_persistence.append_records([order for order, _, _ in batch], data_persistence.orders_journal)
+
+
+# class RegisterClient
+class RegisterClient:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=None, path=None):
+        if path:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def request(self, op, **fields):
+        return (await self.pipeline([dict(op=op, **fields)]))[0]
+
+    async def pipeline(self, requests):
+        """Send several requests at once and read the replies in order."""
+        self.writer.write(b"".join((json.dumps(r) + "\n").encode() for r in requests))
+        await self.writer.drain()
+        return [json.loads(await self.reader.readline()) for _ in requests]
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+# simulate_registers(...) -> dict of latency stats
+async def simulate_registers(host="127.0.0.1", port=None, path=None, registers=100, sales_per_register=10,
+                             skus=("SHIRT-RED-M",), member_id=None):
+    latencies = []
+
+    async def register(n):
+        client = await RegisterClient.connect(host, port, path)
+        await client.request("open", register_id=f"REG-{n:04d}")
+        for _ in range(sales_per_register):
+            started = time.perf_counter()
+            replies = await client.pipeline([{"op": "scan", "sku": sku} for sku in skus]
+                                            + [{"op": "finalize", "member_id": member_id}])
+            latencies.append(time.perf_counter() - started)
+            if not replies[-1]["ok"]:
+                await client.request("clear")
+        await client.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(register(n) for n in range(registers)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "sales": len(latencies),
+        "elapsed_s": elapsed,
+        "sales_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000 if latencies else 0.0,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Run the point-of-sale service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--path", help="serve on a Unix socket instead of TCP")
+    parser.add_argument("--no-persist", action="store_true", help="do not journal sales")
+    args = parser.parse_args()
+    server = await PosServer(args.host, args.port, args.path, persist=not args.no_persist).start()
+    print(f"Serving registers on {args.path or f'{args.host}:{server.port}'}")
+    async with server.server:
+        await server.server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
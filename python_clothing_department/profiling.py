@@ -0,0 +1,144 @@
+import cProfile
+import functools
+import io
+import json
+import pstats
+import threading
+import tracemalloc
+from pathlib import Path
+
+import data_persistence
+import store_system
+
+# ============================
+# OPT-IN PROFILING HOOKS
+# ============================
+# enable() swaps the chosen module functions for wrappers that run 1 in N
+# calls under cProfile (and optionally tracemalloc). disable() puts the
+# original functions back, so nothing is paid while profiling is off.
+#
+# Store functions call each other through module globals, so profiling
+# finalize_sale also catches its remove_from_inventory calls. Code that did
+# `from store_system import finalize_sale` keeps the unwrapped function.
+
+DEFAULT_TARGETS = {
+    store_system: ["add_to_inventory", "remove_from_inventory", "calculate_stock_level", "is_product_in_stock",
+                   "scan_item", "finalize_sale", "finalize_sale_with_items", "finalize_sales",
+                   "award_loyalty_points", "validate_return_eligibility", "process_return",
+                   "process_return_with_items"],
+    data_persistence: ["save_data", "load_data", "append_records", "save_sale", "save_all", "load_all",
+                       "compact_inventory", "export_summary"],
+}
+
+_originals = {}
+_calls = {}
+_samples = {}
+_stats = {}
+_memory = {}
+# Only one profiler can run at a time; overlapping sampled calls run plain
+_profiler_lock = threading.Lock()
+sample_every = 100
+trace_memory = False
+_started_tracemalloc = False
+
+
+def is_enabled():
+    return bool(_originals)
+
+
+def enable(every=100, memory=False, targets=None):
+    """Start sampling 1 in `every` calls of each target function."""
+    global sample_every, trace_memory, _started_tracemalloc
+    disable()
+    sample_every = max(1, every)
+    trace_memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracemalloc = True
+    for module, names in (targets or DEFAULT_TARGETS).items():
+        for name in names:
+            func = getattr(module, name)
+            _originals[(module, name)] = func
+            setattr(module, name, _wrap(f"{module.__name__}.{name}", func))
+
+
+def disable():
+    global _started_tracemalloc
+    for (module, name), func in _originals.items():
+        setattr(module, name, func)
+    _originals.clear()
+    if _started_tracemalloc:
+        tracemalloc.stop()
+        _started_tracemalloc = False
+
+
+def reset():
+    _calls.clear()
+    _samples.clear()
+    _stats.clear()
+    _memory.clear()
+
+
+def _wrap(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        calls = _calls.get(name, 0) + 1
+        _calls[name] = calls
+        if calls % sample_every or not _profiler_lock.acquire(blocking=False):
+            return func(*args, **kwargs)
+        try:
+            return _profile_call(name, func, args, kwargs)
+        finally:
+            _profiler_lock.release()
+    return wrapper
+
+
+def _profile_call(name, func, args, kwargs):
+    tracing = trace_memory and tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+    _samples[name] = _samples.get(name, 0) + 1
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        if name in _stats:
+            _stats[name].add(profiler)
+        else:
+            _stats[name] = pstats.Stats(profiler)
+        if tracing:
+            after, peak = tracemalloc.get_traced_memory()
+            memory = _memory.setdefault(name, {"samples": 0, "net_bytes": 0, "max_peak_bytes": 0})
+            memory["samples"] += 1
+            memory["net_bytes"] += after - before
+            memory["max_peak_bytes"] = max(memory["max_peak_bytes"], peak - before)
+
+
+def summary():
+    """Per-function call counts, sample counts and memory figures."""
+    report = {}
+    for name, calls in _calls.items():
+        stats = _stats.get(name)
+        report[name] = {
+            "calls": calls,
+            "samples": _samples.get(name, 0),
+            "sampled_seconds": stats.total_tt if stats else 0.0,
+        }
+        if name in _memory:
+            report[name]["memory"] = dict(_memory[name])
+    return report
+
+
+def write_reports(directory=None, sort="cumulative", limit=30):
+    """Write profile_<function>.txt for each sampled function and profile_summary.json."""
+    directory = Path(directory or data_persistence.data_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, stats in _stats.items():
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats(sort).print_stats(limit)
+        (directory / f"profile_{name}.txt").write_text(out.getvalue())
+    with open(directory / "profile_summary.json", "w") as f:
+        json.dump(summary(), f, indent=2)
+    return directory
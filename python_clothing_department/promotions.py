@@ -0,0 +1,157 @@
+import store_system
+
+# ============================
+# PROMOTION ENGINE
+# ============================
+# Pricing rules are declared once and compiled into lookup tables:
+#   tier rate      tier -> discount rate on the cart after markdowns/bundles
+#   unit markdown  sku  -> cents off per unit (best of SKU and category rules)
+#   bundles        sku  -> bundles that include it
+# evaluate() then prices a cart with one dict lookup per line, and results are
+# memoized per (tier, cart signature). Call compile() again after the rules
+# or catalog prices change.
+
+
+# class TierDiscount
+class TierDiscount:
+    def __init__(self, tier, rate):
+        if not 0 <= rate <= 1:
+            raise ValueError("rate must be between 0 and 1")
+        self.tier = tier
+        self.rate = rate
+
+
+# class SkuMarkdown
+class SkuMarkdown:
+    def __init__(self, sku, percent=0, cents_off=0):
+        if percent < 0 or cents_off < 0:
+            raise ValueError("markdown must not be negative")
+        self.sku = sku
+        self.percent = percent
+        self.cents_off = cents_off
+
+
+# class CategoryMarkdown
+class CategoryMarkdown:
+    def __init__(self, category, percent):
+        if percent < 0:
+            raise ValueError("markdown must not be negative")
+        self.category = category
+        self.percent = percent
+
+
+# class BundleDeal
+class BundleDeal:
+    """Buying every SKU in `skus` ({sku: qty}) together costs `price_cents`."""
+
+    def __init__(self, name, skus, price_cents):
+        if not skus or price_cents < 0:
+            raise ValueError("invalid bundle")
+        self.name = name
+        self.skus = dict(skus)
+        self.price_cents = price_cents
+
+
+def default_rules():
+    """The loyalty tier discounts finalize_sale has always applied."""
+    return [TierDiscount(tier, rate) for tier, rate in store_system.LOYALTY_DISCOUNT_RATES.items()]
+
+
+# class PromotionEngine
+class PromotionEngine:
+    def __init__(self, rules=None, product_variants=None, cache_size=100000):
+        self.rules = list(default_rules() if rules is None else rules)
+        self.product_variants = store_system.product_variants if product_variants is None else product_variants
+        self.cache_size = cache_size
+        self.compile()
+
+    def compile(self):
+        self.tier_rates = {}
+        self.unit_markdown = {}
+        self.bundles_by_sku = {}
+        sku_rules = {}
+        category_rules = {}
+        for rule in self.rules:
+            if isinstance(rule, TierDiscount):
+                self.tier_rates[rule.tier] = rule.rate
+            elif isinstance(rule, SkuMarkdown):
+                sku_rules[rule.sku] = rule
+            elif isinstance(rule, CategoryMarkdown):
+                category_rules[rule.category] = rule
+            elif isinstance(rule, BundleDeal):
+                for sku in rule.skus:
+                    self.bundles_by_sku.setdefault(sku, []).append(rule)
+            else:
+                raise ValueError(f"Unknown promotion rule: {rule!r}")
+        for sku, product in self.product_variants.items():
+            price = product["price_cents"]
+            off = 0
+            category = category_rules.get(product.get("category"))
+            if category:
+                off = round(price * category.percent / 100)
+            rule = sku_rules.get(sku)
+            if rule:
+                off = max(off, round(price * rule.percent / 100) + rule.cents_off)
+            if off:
+                self.unit_markdown[sku] = min(off, price)
+        self.cache = {}
+
+    def evaluate(self, cart, tier=None):
+        """Price a cart: {"subtotal_cents", "markdown_cents", "bundle_cents",
+        "tier_discount_cents", "discount_cents", "total_cents"}.
+        """
+        qty = {}
+        price = {}
+        for line in cart:
+            qty[line["sku"]] = qty.get(line["sku"], 0) + line["qty"]
+            price[line["sku"]] = line["price_cents"]
+        signature = (tier, tuple(sorted((sku, n, price[sku]) for sku, n in qty.items())))
+        result = self.cache.get(signature)
+        if result is not None:
+            return dict(result)
+
+        subtotal = 0
+        markdown = 0
+        unit_markdown = self.unit_markdown
+        for sku, n in qty.items():
+            subtotal += price[sku] * n
+            markdown += unit_markdown.get(sku, 0) * n
+        bundle = self._bundle_savings(qty, price) if self.bundles_by_sku else 0
+        after = subtotal - markdown - bundle
+        tier_discount = round(after * self.tier_rates.get(tier, 0.0))
+        result = {
+            "subtotal_cents": subtotal,
+            "markdown_cents": markdown,
+            "bundle_cents": bundle,
+            "tier_discount_cents": tier_discount,
+            "discount_cents": markdown + bundle + tier_discount,
+            "total_cents": after - tier_discount,
+        }
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[signature] = result
+        return dict(result)
+
+    def evaluate_batch(self, carts):
+        """Price a list of (cart, tier) pairs."""
+        return [self.evaluate(cart, tier) for cart, tier in carts]
+
+    def _bundle_savings(self, qty, price):
+        # Greedy: apply the bundle saving the most per use first, as many
+        # times as the remaining quantities allow
+        candidates = {id(b): b for sku in qty for b in self.bundles_by_sku.get(sku, ())}.values()
+        offers = []
+        for bundle in candidates:
+            if all(qty.get(sku, 0) >= need for sku, need in bundle.skus.items()):
+                regular = sum((price[sku] - self.unit_markdown.get(sku, 0)) * need
+                              for sku, need in bundle.skus.items())
+                if regular > bundle.price_cents:
+                    offers.append((regular - bundle.price_cents, bundle))
+        remaining = dict(qty)
+        saved = 0
+        for saving, bundle in sorted(offers, key=lambda offer: -offer[0]):
+            times = min(remaining[sku] // need for sku, need in bundle.skus.items())
+            for sku, need in bundle.skus.items():
+                remaining[sku] -= need * times
+            saved += saving * times
+        return saved
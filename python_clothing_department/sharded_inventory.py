@@ -0,0 +1,322 @@
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from store_system import MovementLog
+
+# ============================
+# SKU-SHARDED INVENTORY ENGINE
+# ============================
+# SKUs are hash-partitioned across worker processes, and each worker owns
+# the MovementLog for its shard. The engine has the same on_hand, append,
+# remove_many, remove_batch and locked methods that store_system uses on its
+# ledger, so installing it routes every stock call to the shard that owns
+# the SKU:
+#
+#   store_system.inventory_movements = ShardedInventory(store_system.inventory_movements)
+#
+# A removal that spans several shards is two-phase: every shard first
+# reserves its part (prepare), and only when all succeed are the reservations
+# committed; otherwise they are released. Each shard pipe has its own lock,
+# so threads working on different shards run in parallel.
+#
+# Every message is a pipe round trip, so batches are what pay for the
+# workers: remove_batch (used by store_system.finalize_sales) sends one
+# prepare and one resolve message per shard for a whole list of carts.
+#
+# The parent numbers movements itself: each append and commit carries a
+# "seq" from one engine-wide counter, so stock_at positions mean the same as
+# on a single MovementLog.
+
+
+def shard_for(sku, shards):
+    return zlib.crc32(sku.encode()) % shards
+
+
+# class _Shard
+class _Shard:
+    """Runs in a worker process and answers (op, *args) messages."""
+
+    def __init__(self, movements):
+        self.ledger = MovementLog(movements)
+        self.reserved = {}
+        self.prepared = {}
+        self.handlers = {
+            "stock": self.op_stock,
+            "stock_at": self.op_stock_at,
+            "stock_at_time": self.op_stock_at_time,
+            "append": self.op_append,
+            "remove": self.op_remove,
+            "prepare": self.op_prepare,
+            "prepare_batch": self.op_prepare_batch,
+            "resolve_batch": self.op_resolve_batch,
+            "totals": self.op_totals,
+        }
+
+    def available(self, sku):
+        return self.ledger.on_hand(sku) - self.reserved.get(sku, 0)
+
+    def op_stock(self, sku):
+        return self.ledger.on_hand(sku)
+
+    def op_stock_at(self, sku, position):
+        return self.ledger.stock_at(sku, position)
+
+    def op_stock_at_time(self, sku, ts):
+        return self.ledger.stock_at_time(sku, ts)
+
+    def op_append(self, movement):
+        self.ledger.append(movement)
+
+    def op_remove(self, needed, seqs):
+        short_sku = self.op_prepare(None, needed)
+        if short_sku is None:
+            self.op_resolve_batch([None], [], seqs)
+        return short_sku
+
+    def op_prepare(self, txn, needed):
+        for sku in sorted(needed):
+            if self.available(sku) < needed[sku]:
+                return sku
+        for sku, qty in needed.items():
+            self.reserved[sku] = self.reserved.get(sku, 0) + qty
+        self.prepared[txn] = needed
+        return None
+
+    def op_prepare_batch(self, entries):
+        shorts = []
+        try:
+            for txn, needed in entries:
+                shorts.append(self.op_prepare(txn, needed))
+        except Exception:
+            for (txn, _), short_sku in zip(entries, shorts):
+                if short_sku is None:
+                    self._release(txn)
+            raise
+        return shorts
+
+    def op_resolve_batch(self, commits, aborts, seqs):
+        """Release every listed reservation; the committed ones become one
+        movement per SKU, numbered from `seqs`."""
+        for txn in aborts:
+            self._release(txn)
+        taken = {}
+        for txn in commits:
+            for sku, qty in self._release(txn).items():
+                taken[sku] = taken.get(sku, 0) + qty
+        now = time.time()
+        for sku in sorted(taken):
+            self.ledger.append({"sku": sku, "qty_change": -taken[sku], "ts": now, "seq": seqs[sku]})
+
+    def _release(self, txn):
+        needed = self.prepared.pop(txn, {})
+        for sku, qty in needed.items():
+            self.reserved[sku] -= qty
+        return needed
+
+    def op_totals(self):
+        return dict(self.ledger.stock)
+
+
+def _serve(conn, movements):
+    shard = _Shard(movements)
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message[0] == "stop":
+            conn.close()
+            return
+        try:
+            conn.send((True, shard.handlers[message[0]](*message[1:])))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+
+# class ShardedInventory
+class ShardedInventory:
+    def __init__(self, movements=(), shards=None):
+        self.shards = shards or os.cpu_count() or 1
+        # Workers start from one folded snapshot row per SKU, not the history
+        baselines = [{} for _ in range(self.shards)]
+        as_of = 0.0
+        last_seq = -1
+        for position, movement in enumerate(movements):
+            baseline = baselines[shard_for(movement["sku"], self.shards)]
+            baseline[movement["sku"]] = baseline.get(movement["sku"], 0) + movement["qty_change"]
+            as_of = max(as_of, movement.get("ts", as_of))
+            last_seq = max(last_seq, movement.get("seq", position))
+        self.conns = []
+        self.workers = []
+        self.shard_locks = [threading.RLock() for _ in range(self.shards)]
+        self.txn_ids = itertools.count(1)
+        # Taken only while holding the shard locks involved, so each shard
+        # sees its seqs in increasing order
+        self.seqs = itertools.count(last_seq + 1)
+        for baseline in baselines:
+            parent, child = multiprocessing.Pipe()
+            rows = [{"sku": sku, "qty_change": qty, "snapshot": True, "ts": as_of, "seq": last_seq}
+                    for sku, qty in baseline.items() if qty]
+            worker = multiprocessing.Process(target=_serve, args=(child, rows), daemon=True)
+            worker.start()
+            child.close()
+            self.conns.append(parent)
+            self.workers.append(worker)
+
+    def close(self):
+        for conn, worker in zip(self.conns, self.workers):
+            try:
+                conn.send(("stop",))
+            except OSError:
+                pass
+            conn.close()
+            worker.join()
+        self.conns = []
+        self.workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _send(self, shard, *message):
+        self.conns[shard].send(message)
+
+    def _recv(self, shard):
+        ok, value = self.conns[shard].recv()
+        if not ok:
+            raise RuntimeError(f"Inventory shard {shard} failed: {value}")
+        return value
+
+    def _call(self, shard, *message):
+        with self.shard_locks[shard]:
+            self._send(shard, *message)
+            return self._recv(shard)
+
+    def _split(self, needed):
+        parts = {}
+        for sku, qty in needed.items():
+            parts.setdefault(shard_for(sku, self.shards), {})[sku] = qty
+        return parts
+
+    def _number(self, skus):
+        return {sku: next(self.seqs) for sku in sorted(skus)}
+
+    @contextmanager
+    def _holding(self, shards):
+        locks = [self.shard_locks[shard] for shard in sorted(set(shards))]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def locked(self, skus):
+        """Hold the shards owning these SKUs, always taken in shard order."""
+        return self._holding(shard_for(sku, self.shards) for sku in skus)
+
+    def on_hand(self, sku):
+        return self._call(shard_for(sku, self.shards), "stock", sku)
+
+    def stock_at(self, sku, position):
+        """On hand for `sku` counting only the movements with seq < `position`."""
+        return self._call(shard_for(sku, self.shards), "stock_at", sku, position)
+
+    def stock_at_time(self, sku, ts):
+        """On hand for `sku` as of `ts`; earlier than the engine's start raises."""
+        return self._call(shard_for(sku, self.shards), "stock_at_time", sku, ts)
+
+    def append(self, movement):
+        shard = shard_for(movement["sku"], self.shards)
+        with self.shard_locks[shard]:
+            if movement.get("seq") is None:
+                movement["seq"] = next(self.seqs)
+            self._send(shard, "append", movement)
+            self._recv(shard)
+
+    def remove_many(self, needed):
+        """Take {sku: qty} out of stock on every shard at once, or not at all.
+
+        Returns None on success, otherwise the first SKU that is short.
+        """
+        parts = self._split(needed)
+        if len(parts) == 1:
+            (shard, part), = parts.items()
+            with self.shard_locks[shard]:
+                self._send(shard, "remove", part, self._number(part))
+                return self._recv(shard)
+        return self.remove_batch([needed])[0]
+
+    def remove_batch(self, batch):
+        """remove_many for a list of {sku: qty} requests with one prepare and
+        one resolve message per shard. Requests reserve stock in order, so
+        one can be refused for stock held by an earlier request that then
+        fails on another shard. Returns one result per request.
+        """
+        base = next(self.txn_ids)
+        entries = {}
+        for i, needed in enumerate(batch):
+            for shard, part in self._split(needed).items():
+                entries.setdefault(shard, []).append(((base, i), part))
+        results = [None] * len(batch)
+        with self._holding(entries):
+            for shard, shard_entries in entries.items():
+                self._send(shard, "prepare_batch", shard_entries)
+            # Every reply is read even after a failure, so no pipe is left a
+            # reply behind, and every reservation is released before raising
+            shorts = {}
+            errors = []
+            for shard in entries:
+                try:
+                    shorts[shard] = self._recv(shard)
+                except Exception as e:
+                    errors.append(e)
+            for shard, replies in shorts.items():
+                for ((_, i), _), short_sku in zip(entries[shard], replies):
+                    if short_sku is not None and (results[i] is None or short_sku < results[i]):
+                        results[i] = short_sku
+            resolves = {}
+            for shard, replies in shorts.items():
+                commits, aborts, taken = [], [], set()
+                for (txn, part), short_sku in zip(entries[shard], replies):
+                    if short_sku is not None:
+                        continue
+                    if errors or results[txn[1]] is not None:
+                        aborts.append(txn)
+                    else:
+                        commits.append(txn)
+                        taken.update(part)
+                resolves[shard] = (commits, aborts, taken)
+            seqs = self._number(sku for _, _, taken in resolves.values() for sku in taken)
+            sent = []
+            try:
+                for shard, (commits, aborts, taken) in resolves.items():
+                    self._send(shard, "resolve_batch", commits, aborts, {sku: seqs[sku] for sku in taken})
+                    sent.append(shard)
+            finally:
+                for shard in sent:
+                    try:
+                        self._recv(shard)
+                    except Exception as e:
+                        errors.append(e)
+            if errors:
+                raise errors[0]
+        return results
+
+    def totals(self):
+        """Return {sku: on-hand total} gathered from every shard."""
+        with self._holding(range(self.shards)):
+            for shard in range(self.shards):
+                self._send(shard, "totals")
+            stock = {}
+            for shard in range(self.shards):
+                stock.update(self._recv(shard))
+        return stock
@@ -0,0 +1,226 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import data_persistence
+from instrumentation import timed
+
+# ============================
+# SQLITE STORAGE BACKEND
+# ============================
+# Drop-in alternative to data_persistence's JSON files with the same
+# save_all/load_all interface, plus per-sale writes and indexed point
+# queries. The database lives next to the JSON files as data/store.db and
+# runs in WAL mode, so readers never block the writer.
+#
+#   import sqlite_persistence as persistence
+#   persistence.save_sale(order, items, movements)
+#   persistence.stock_level("SHIRT-RED-M")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS movements (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sku TEXT NOT NULL,
+    qty_change INTEGER NOT NULL,
+    snapshot INTEGER NOT NULL DEFAULT 0,
+    ts REAL
+);
+CREATE INDEX IF NOT EXISTS movements_sku ON movements (sku);
+CREATE TABLE IF NOT EXISTS stock (
+    sku TEXT PRIMARY KEY,
+    on_hand INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS customers (
+    member_id TEXT PRIMARY KEY,
+    name TEXT,
+    tier TEXT,
+    points INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY,
+    order_code TEXT,
+    member_id TEXT,
+    status TEXT NOT NULL,
+    total_cents INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_member ON orders (member_id);
+CREATE TABLE IF NOT EXISTS order_items (
+    id INTEGER,
+    order_id INTEGER NOT NULL,
+    sku TEXT NOT NULL,
+    qty INTEGER NOT NULL,
+    returned_from INTEGER
+);
+CREATE INDEX IF NOT EXISTS order_items_order ON order_items (order_id, sku);
+"""
+
+_connection = None
+_connection_path = None
+_lock = threading.RLock()
+
+
+def database_file():
+    return data_persistence.data_dir / "store.db"
+
+
+def connect():
+    """Open (or reuse) the connection for the current data directory."""
+    global _connection, _connection_path
+    path = database_file()
+    with _lock:
+        if _connection is None or _connection_path != path:
+            if _connection is not None:
+                _connection.close()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            _connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            _connection.execute("PRAGMA journal_mode=WAL")
+            _connection.execute("PRAGMA synchronous=NORMAL")
+            _connection.executescript(SCHEMA)
+            _connection_path = path
+        return _connection
+
+
+def close():
+    global _connection, _connection_path
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+        _connection = None
+        _connection_path = None
+
+
+@contextmanager
+def _transaction():
+    with _lock:
+        db = connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+
+def _insert_movements(db, movements):
+    rows = [(m["sku"], m["qty_change"], 1 if m.get("snapshot") else 0, m.get("ts")) for m in movements]
+    db.executemany("INSERT INTO movements (sku, qty_change, snapshot, ts) VALUES (?, ?, ?, ?)", rows)
+    deltas = {}
+    for sku, qty_change, _, _ in rows:
+        deltas[sku] = deltas.get(sku, 0) + qty_change
+    db.executemany("INSERT INTO stock (sku, on_hand) VALUES (?, ?) "
+                   "ON CONFLICT (sku) DO UPDATE SET on_hand = on_hand + excluded.on_hand", deltas.items())
+
+
+def _insert_orders(db, orders):
+    db.executemany("INSERT OR REPLACE INTO orders (id, order_code, member_id, status, total_cents) "
+                   "VALUES (?, ?, ?, ?, ?)",
+                   [(o["id"], o.get("order_code"), o.get("member_id"), o["status"], o["total_cents"])
+                    for o in orders])
+
+
+def _insert_order_items(db, order_items):
+    db.executemany("INSERT INTO order_items (id, order_id, sku, qty, returned_from) VALUES (?, ?, ?, ?, ?)",
+                   [(i.get("id"), i["order_id"], i["sku"], i["qty"], i.get("returned_from")) for i in order_items])
+
+
+def _upsert_customers(db, customers):
+    db.executemany("INSERT OR REPLACE INTO customers (member_id, name, tier, points) VALUES (?, ?, ?, ?)",
+                   [(member_id, c.get("name"), c.get("tier"), c.get("points", 0))
+                    for member_id, c in customers.items()])
+
+
+# Save all data: replaces every table in one transaction
+@timed("sqlite.save_all")
+def save_all(inventory_movements, customers, orders, order_items):
+    with _transaction() as db:
+        for table in ("movements", "stock", "customers", "orders", "order_items"):
+            db.execute(f"DELETE FROM {table}")
+        _insert_movements(db, inventory_movements)
+        _upsert_customers(db, customers)
+        _insert_orders(db, orders)
+        _insert_order_items(db, order_items)
+
+
+# Load all data in the same shapes as data_persistence.load_all
+@timed("sqlite.load_all")
+def load_all():
+    db = connect()
+    with _lock:
+        inventory_movements = [_movement(row) for row in db.execute(
+            "SELECT sku, qty_change, snapshot, ts FROM movements ORDER BY id")]
+        customers = {
+            member_id: {"member_id": member_id, "name": name, "tier": tier, "points": points}
+            for member_id, name, tier, points in db.execute("SELECT member_id, name, tier, points FROM customers")
+        }
+        orders = [
+            {"id": id, "order_code": code, "member_id": member_id, "status": status, "total_cents": total}
+            for id, code, member_id, status, total in db.execute(
+                "SELECT id, order_code, member_id, status, total_cents FROM orders ORDER BY id")
+        ]
+        order_items = [_item(row) for row in db.execute(
+            "SELECT id, order_id, sku, qty, returned_from FROM order_items ORDER BY rowid")]
+    return inventory_movements, customers, orders, order_items
+
+
+def _movement(row):
+    sku, qty_change, snapshot, ts = row
+    movement = {"sku": sku, "qty_change": qty_change}
+    if snapshot:
+        movement["snapshot"] = True
+    if ts is not None:
+        movement["ts"] = ts
+    return movement
+
+
+def _item(row):
+    id, order_id, sku, qty, returned_from = row
+    item = {"order_id": order_id, "sku": sku, "qty": qty}
+    if id is not None:
+        item = {"id": id, **item}
+    if returned_from is not None:
+        item["returned_from"] = returned_from
+    return item
+
+
+# Write one sale or return atomically; cost does not depend on history
+@timed("sqlite.save_sale")
+def save_sale(order, order_items, inventory_movements, customer=None):
+    with _transaction() as db:
+        _insert_movements(db, inventory_movements)
+        _insert_orders(db, [order])
+        _insert_order_items(db, order_items)
+        if customer is not None:
+            _upsert_customers(db, {customer["member_id"]: customer})
+
+
+def stock_level(sku):
+    with _lock:
+        row = connect().execute("SELECT on_hand FROM stock WHERE sku = ?", (sku,)).fetchone()
+    return row[0] if row else 0
+
+
+def items_for_order(order_id):
+    with _lock:
+        rows = connect().execute("SELECT id, order_id, sku, qty, returned_from FROM order_items "
+                                 "WHERE order_id = ? ORDER BY rowid", (order_id,)).fetchall()
+    return [_item(row) for row in rows]
+
+
+def get_order(order_id):
+    with _lock:
+        row = connect().execute("SELECT id, order_code, member_id, status, total_cents FROM orders WHERE id = ?",
+                                (order_id,)).fetchone()
+    if row is None:
+        return None
+    id, code, member_id, status, total = row
+    return {"id": id, "order_code": code, "member_id": member_id, "status": status, "total_cents": total}
+
+
+def get_customer(member_id):
+    with _lock:
+        row = connect().execute("SELECT member_id, name, tier, points FROM customers WHERE member_id = ?",
+                                (member_id,)).fetchone()
+    if row is None:
+        return None
+    return dict(zip(("member_id", "name", "tier", "points"), row))
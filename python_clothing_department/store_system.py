@@ -1,75 +1,418 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+
+from instrumentation import count, emit, timed
+
+
+# class TrackedList
+class TrackedList(list):
+    """List that keeps derived lookup state in step with its rows.
+
+    Subclasses fill in _reset() and _apply(row); appends update the state
+    incrementally and anything that drops or reorders rows rebuilds it.
+    """
+
+    def __init__(self, rows=()):
+        super().__init__()
+        self._reset()
+        self.extend(rows)
+
+    def _reset(self):
+        pass
+
+    def _apply(self, row):
+        pass
+
+    def rebuild(self):
+        self._reset()
+        for row in self:
+            self._apply(row)
+
+    def append(self, row):
+        super().append(row)
+        self._apply(row)
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def __iadd__(self, rows):
+        self.extend(rows)
+        return self
+
+    def clear(self):
+        super().clear()
+        self._reset()
+
+    def insert(self, index, row):
+        super().insert(index, row)
+        self.rebuild()
+
+    def pop(self, index=-1):
+        row = super().pop(index)
+        self.rebuild()
+        return row
+
+    def remove(self, row):
+        super().remove(row)
+        self.rebuild()
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self.rebuild()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self.rebuild()
+
+    def __imul__(self, n):
+        super().__imul__(n)
+        self.rebuild()
+        return self
+
+    def sort(self, *, key=None, reverse=False):
+        super().sort(key=key, reverse=reverse)
+        self.rebuild()
+
+    def reverse(self):
+        super().reverse()
+        self.rebuild()
+
+
+# _movement(sku, qty_change) -> dict
+def _movement(sku, qty_change):
+    return {"sku": sku, "qty_change": qty_change, "ts": time.time()}
+
+
+# class MovementLog
+class MovementLog(TrackedList):
+    """Inventory movement history that keeps a running on-hand total per SKU.
+
+    Appends take a per-SKU lock, so registers in different threads only
+    contend when they touch the same SKU. The row itself is added under one
+    short log-wide lock, which keeps sequence numbers in step with the rows.
+
+    Each row gets a "seq" when first appended (rows that already carry one
+    keep it), and a row's position is its seq: it does not change when rows
+    are removed, reordered or compacted. For point-in-time queries each SKU
+    keeps the seqs of its movements, their timestamps and the on-hand total
+    after each one, so a historical lookup is one bisect. Rows without a
+    "ts" take the timestamp of the row before them. Snapshot rows hold a
+    baseline that is only known from their own "seq" and "ts" on, so
+    queries before that are rejected.
+    """
+
+    def __init__(self, movements=()):
+        self.locks = {}
+        self.write_lock = threading.RLock()
+        super().__init__(movements)
+
+    def _reset(self):
+        self.stock = {}
+        self.positions = {}
+        self.times = {}
+        self.prefix = {}
+        self._next_seq = 0
+        self._last_ts = 0.0
+        self.history_from = 0.0
+        self.history_seq = 0
+
+    def _apply(self, movement):
+        sku = movement["sku"]
+        seq = movement.get("seq")
+        if seq is None:
+            seq = movement["seq"] = self._next_seq
+        self._next_seq = max(self._next_seq, seq + 1)
+        total = self.stock.get(sku, 0) + movement["qty_change"]
+        self.stock[sku] = total
+        self._last_ts = max(movement.get("ts", self._last_ts), self._last_ts)
+        if movement.get("snapshot"):
+            self.history_from = max(self.history_from, movement.get("ts", float("inf")))
+            self.history_seq = max(self.history_seq, seq + 1)
+        if sku not in self.positions:
+            self.positions[sku] = []
+            self.times[sku] = []
+            self.prefix[sku] = []
+        self.positions[sku].append(seq)
+        self.times[sku].append(self._last_ts)
+        self.prefix[sku].append(total)
+
+    def rebuild(self):
+        # Replays rows in seq order, so reordering the list changes no
+        # history, and keeps numbering after the highest seq handed out
+        next_seq = self._next_seq
+        self._reset()
+        for movement in sorted(list.__iter__(self), key=lambda m: m["seq"]):
+            self._apply(movement)
+        self._next_seq = max(self._next_seq, next_seq)
+
+    def on_hand(self, sku):
+        return self.stock.get(sku, 0)
+
+    def stock_at(self, sku, position):
+        """On hand for `sku` counting only the movements with seq < `position`."""
+        if position < self.history_seq:
+            raise ValueError(f"Movements before position {self.history_seq} have been compacted")
+        n = bisect_left(self.positions.get(sku, ()), position)
+        return self.prefix[sku][n - 1] if n else 0
+
+    def stock_at_time(self, sku, ts):
+        """On hand for `sku` counting the movements stamped at or before `ts`."""
+        if ts < self.history_from:
+            raise ValueError(f"Movements before {self.history_from} have been compacted")
+        n = bisect_right(self.times.get(sku, ()), ts)
+        return self.prefix[sku][n - 1] if n else 0
+
+    def net_change(self, sku, start, end):
+        """Net quantity change for `sku` over movements start <= position < end."""
+        return self.stock_at(sku, end) - self.stock_at(sku, start)
+
+    def lock_for(self, sku):
+        lock = self.locks.get(sku)
+        if lock is None:
+            lock = self.locks.setdefault(sku, threading.RLock())
+        return lock
+
+    @contextmanager
+    def locked(self, skus):
+        """Hold the locks for several SKUs, always taken in sorted order."""
+        locks = [self.lock_for(sku) for sku in sorted(set(skus))]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def append(self, movement):
+        with self.lock_for(movement["sku"]), self.write_lock:
+            super().append(movement)
+
+    def remove_many(self, needed):
+        """Take {sku: qty} out of stock all at once, or not at all.
+
+        Returns None on success, otherwise the first SKU that is short.
+        """
+        with self.locked(needed):
+            for sku in sorted(needed):
+                if self.on_hand(sku) < needed[sku]:
+                    return sku
+            for sku, qty in needed.items():
+                self.append(_movement(sku, -qty))
+        return None
+
+    def remove_batch(self, batch):
+        """remove_many for a list of {sku: qty} requests, checked in order
+        against what the earlier ones took. Returns one result per request;
+        the stock taken is recorded as one movement per SKU.
+        """
+        results = []
+        demand = {}
+        with self.locked(sku for needed in batch for sku in needed):
+            for needed in batch:
+                short_sku = next((sku for sku in sorted(needed)
+                                  if self.on_hand(sku) - demand.get(sku, 0) < needed[sku]), None)
+                results.append(short_sku)
+                if short_sku is None:
+                    for sku, qty in needed.items():
+                        demand[sku] = demand.get(sku, 0) + qty
+            for sku in sorted(demand):
+                self.append(_movement(sku, -demand[sku]))
+        return results
+
+    def compact(self, keep=0):
+        """Fold all but the last `keep` movements into one snapshot row per SKU.
+
+        Stock levels are unchanged. Returns the folded rows so the caller can
+        archive them. Holds every SKU lock and then the write lock, so other
+        threads neither append nor read a half-rebuilt total meanwhile.
+        """
+        with self.locked(list(self.stock)), self.write_lock:
+            cut = max(len(self) - keep, 0)
+            folded = list.__getitem__(self, slice(0, cut))
+            tail = list.__getitem__(self, slice(cut, None))
+            baseline = {}
+            as_of = 0.0
+            for movement in folded:
+                baseline[movement["sku"]] = baseline.get(movement["sku"], 0) + movement["qty_change"]
+                as_of = max(as_of, movement.get("ts", as_of))
+            last_seq = max((movement["seq"] for movement in folded), default=-1)
+            snapshot = [{"sku": sku, "qty_change": qty, "snapshot": True, "ts": as_of, "seq": last_seq}
+                        for sku, qty in baseline.items() if qty]
+            # list-level calls: the rows are already checked and locked
+            list.clear(self)
+            list.extend(self, snapshot + tail)
+            self.rebuild()
+        return folded
+
+
+# class IndexedList
+class IndexedList(TrackedList):
+    """List of records with a dict index on key(record).
+
+    Like a linear next(...) scan, the index keeps the first record for a key.
+    """
+
+    def __init__(self, rows=(), key=None):
+        self.key = key
+        super().__init__(rows)
+
+    def _reset(self):
+        self.index = {}
+
+    def _apply(self, row):
+        self.index.setdefault(self.key(row), row)
+
+    def get(self, key, default=None):
+        return self.index.get(key, default)
+
+
+# class OrderItemLog
+class OrderItemLog(IndexedList):
+    """Order items indexed by (order_id, sku), plus a running tally per order
+    line of units sold and units returned so far.
+
+    Return rows carry "returned_from", the order whose line they give back to.
+    """
+
+    def __init__(self, rows=()):
+        super().__init__(rows, key=lambda oi: (oi["order_id"], oi["sku"]))
+
+    def _reset(self):
+        super()._reset()
+        self.lines = {}
+
+    def _apply(self, row):
+        super()._apply(row)
+        original = row.get("returned_from")
+        key = (row["order_id"] if original is None else original, row["sku"])
+        line = self.lines.get(key)
+        if line is None:
+            line = self.lines[key] = {"sold": 0, "returned": 0}
+        line["sold" if original is None else "returned"] += row["qty"]
+
+    def returnable(self, order_id, sku):
+        line = self.lines.get((order_id, sku))
+        return line["sold"] - line["returned"] if line else 0
+
+
+# class IdAllocator
+class IdAllocator:
+    """Numbers new rows len(rows) + 1, len(rows) + 2, ... and appends them
+    under one lock, so concurrent writers never reuse an id.
+
+    With a `source` (a callable returning the next id, such as
+    data_persistence.BlockIdSource) ids come from it instead. Without one,
+    ids are only unique within this process.
+    """
+
+    def __init__(self, rows, source=None):
+        self.rows = rows
+        self.source = source
+        self.lock = threading.Lock()
+
+    def _ids(self, n):
+        if self.source is None:
+            return range(len(self.rows) + 1, len(self.rows) + 1 + n)
+        return [self.source() for _ in range(n)]
+
+    def append(self, build):
+        """Append build(new_id) and return it."""
+        with self.lock:
+            row = build(self._ids(1)[0])
+            self.rows.append(row)
+        return row
+
+    def extend(self, items, build):
+        """Append build(new_id, item) for each item as one block."""
+        items = list(items)
+        with self.lock:
+            new_rows = [build(new_id, item) for new_id, item in zip(self._ids(len(items)), items)]
+            self.rows.extend(new_rows)
+        return new_rows
+
+
 # check_inventory(sku) -> int
 def check_inventory(sku):
-    
-    total = 0
-    for movement in inventory_movements:
-        if movement["sku"] == sku:
-            total += movement["qty_change"]
-    return total
+    return inventory_movements.on_hand(sku)
 
 
 # add_to_inventory(sku, qty) -> dict
+@timed("add_to_inventory")
 def add_to_inventory(sku, qty):
     """Add stock (like receiving new shirts)."""
     if qty <= 0:
-        print("Quantity must be positive.")
+        emit("inventory.invalid_qty", "Quantity must be positive.", sku=sku, qty=qty)
         return None
     if sku not in product_variants:
-        print("SKU not found.")
+        emit("inventory.unknown_sku", "SKU not found.", sku=sku)
         return None
-    inventory_movements.append({"sku": sku, "qty_change": qty})
+    inventory_movements.append(_movement(sku, qty))
     new_qty = calculate_stock_level(sku)
-    print(f"Added {qty} units to {sku}. New stock: {new_qty}")
+    emit("inventory.added", "Added {qty} units to {sku}. New stock: {new_qty}", sku=sku, qty=qty, new_qty=new_qty)
     return {"sku": sku, "new_qty": new_qty}
 
 
 # remove_from_inventory(sku, qty) -> dict
+@timed("remove_from_inventory")
 def remove_from_inventory(sku, qty):
     if qty <= 0:
-        print("Quantity must be positive")
+        emit("inventory.invalid_qty", "Quantity must be positive", sku=sku, qty=qty)
         return None
 
-    if not any(p["sku"] == sku for p in product_variants):
-        print("SKU not found")
+    if sku not in product_variants:
+        emit("inventory.unknown_sku", "SKU not found", sku=sku)
         return None
 
-    current_stock = calculate_stock_level(sku)
-    if current_stock < qty:
-        print(f"Insufficient stock. Available: {current_stock}, Requested: {qty}")
+    if inventory_movements.remove_many({sku: qty}) is not None:
+        emit("inventory.insufficient", "Insufficient stock. Available: {available}, Requested: {qty}",
+             sku=sku, available=calculate_stock_level(sku), qty=qty)
         return None
 
-    inventory_movements.append({"sku": sku, "qty_change": -qty})
     new_qty = calculate_stock_level(sku)
-    print(f"Removed {qty} units from {sku}. New stock: {new_qty}")
+    emit("inventory.removed", "Removed {qty} units from {sku}. New stock: {new_qty}", sku=sku, qty=qty, new_qty=new_qty)
     return {"sku": sku, "new_qty": new_qty}
 
 
 # calculate_stock_level(sku) -> int
 def calculate_stock_level(sku):
-    """Add up all stock movements for one product."""
-    total = 0
-    for move in inventory_movements:
-        if move["sku"] == sku:
-            total = total + move["qty_change"]
-    return total
+    """Read the running on-hand total for one product from the ledger."""
+    count("stock_checks")
+    return inventory_movements.on_hand(sku)
+
+
+# stock_level_at(sku, ts=None, position=None) -> int
+def stock_level_at(sku, ts=None, position=None):
+    """On hand for one product as of a timestamp or a position in the ledger."""
+    if position is not None:
+        return inventory_movements.stock_at(sku, position)
+    if ts is not None:
+        return inventory_movements.stock_at_time(sku, ts)
+    return inventory_movements.on_hand(sku)
 
 
 # is_product_in_stock(sku, qty) -> bool
-inventory_movements = [
+inventory_movements = MovementLog([
     {"sku": "SHIRT-RED-M", "qty_change": 10},
     {"sku": "SHIRT-BLUE-L", "qty_change": 5},
-]
+])
 
 def is_product_in_stock(sku, qty):
     current_stock = calculate_stock_level(sku)
     return current_stock >= qty
 
 
-# scan_item(cart, sku) -> list
+# scan_item(cart, sku) -> list or Cart
 def scan_item(cart, sku):
-    product = next((p for p in product_variants if p["sku"] == sku and p["active"]), None)
-    if product is None:
+    product = product_variants.get(sku)
+    if product is None or not product.get("active", True):
         raise ValueError(f"Product with SKU '{sku}' not found or inactive.")
+    if isinstance(cart, Cart):
+        cart.add_line(sku, product["price_cents"])
+        return cart
     for item in cart:
         if item["sku"] == sku:
             item["qty"] += 1
@@ -84,6 +427,8 @@ def scan_item(cart, sku):
 
 # calculate_cart_total(cart) -> total_cents
 def calculate_cart_total(cart):
+    if isinstance(cart, Cart):
+        return cart.total_price_cents()
     total = 0
     for item in cart:
         total += item["qty"] * item["price_cents"]
@@ -93,7 +438,7 @@ def calculate_cart_total(cart):
 # generate_order_code(order_id) -> string
 def generate_order_code(order_id):
     if order_id < 0:
-        print("Order ID must be positive.")
+        emit("order.invalid_id", "Order ID must be positive.", order_id=order_id)
         return None
     order_str = str(order_id)
     while len(order_str) < 4:
@@ -101,61 +446,166 @@ def generate_order_code(order_id):
     return "ORD-" + order_str
 
 
-# finalize_sale(cart, member_id=None) -> order
-def finalize_sale(cart, member_id=None):
+# _cart_demand(cart) -> ({sku: qty}, error)
+def _cart_demand(cart):
+    needed = {}
+    for item in cart:
+        sku = item["sku"]
+        if sku not in product_variants:
+            return None, f"SKU {sku} not found."
+        if item["qty"] <= 0:
+            return None, f"Quantity for {sku} must be positive."
+        needed[sku] = needed.get(sku, 0) + item["qty"]
+    return needed, None
+
+
+# _order_item(item_id, order_id, line) -> dict
+def _order_item(item_id, order_id, line, returned_from=None):
+    item = {
+        "id": item_id,
+        "order_id": order_id,
+        "sku": line["sku"],
+        "qty": line["qty"]
+    }
+    if returned_from is not None:
+        item["returned_from"] = returned_from
+    return item
+
+
+# finalize_sale(cart, member_id=None, promotions=None) -> order
+def finalize_sale(cart, member_id=None, promotions=None):
+    """Sell a cart. With a promotions.PromotionEngine, the engine prices the
+    whole cart (markdowns, bundles and tier discount) instead of the plain
+    loyalty discount.
+    """
+    return finalize_sale_with_items(cart, member_id, promotions)[0]
+
+
+# finalize_sale_with_items(cart, member_id=None, promotions=None) -> (order, items)
+@timed("finalize_sale")
+def finalize_sale_with_items(cart, member_id=None, promotions=None):
+    """finalize_sale that also returns the order item rows it created."""
     if not cart:
-        print("Cart is empty.")
-        return None
-    total_cents = calculate_cart_total(cart)
-    discount_cents = 0
-    if member_id and validate_member_id(member_id):
-        discount_cents = compute_loyalty_discount(member_id, total_cents)
-        total_cents -= discount_cents
-    new_order_id = len(orders) + 1
-    order_code = generate_order_code(new_order_id)
-    order = {
-        "id": new_order_id,
-        "order_code": order_code,
+        emit("sale.rejected", "Cart is empty.", member_id=member_id)
+        return None, []
+    needed, error = _cart_demand(cart)
+    if error:
+        emit("sale.rejected", "{error}", member_id=member_id, error=error)
+        return None, []
+    is_member = bool(member_id) and validate_member_id(member_id)
+    if promotions is not None:
+        tier = customers[member_id].get("tier", "NONE") if is_member else None
+        total_cents = promotions.evaluate(cart, tier)["total_cents"]
+    else:
+        total_cents = calculate_cart_total(cart)
+        if is_member:
+            total_cents -= compute_loyalty_discount(member_id, total_cents)
+    short_sku = inventory_movements.remove_many(needed)
+    if short_sku is not None:
+        emit("sale.rejected", "Insufficient stock for {sku}. Available: {available}, Requested: {qty}",
+             member_id=member_id, sku=short_sku, available=calculate_stock_level(short_sku), qty=needed[short_sku])
+        return None, []
+    order = order_ids.append(lambda order_id: {
+        "id": order_id,
+        "order_code": generate_order_code(order_id),
         "member_id": member_id,
         "status": "PAID",
         "total_cents": total_cents
-    }
-    orders.append(order)
-    for item in cart:
-        order_item = {
-            "id": len(order_items) + 1,
-            "order_id": new_order_id,
-            "sku": item["sku"],
-            "qty": item["qty"]
-        }
-        order_items.append(order_item)
-        remove_from_inventory(item["sku"], item["qty"])
-    if member_id and validate_member_id(member_id):
+    })
+    items = order_item_ids.extend(cart, lambda item_id, line: _order_item(item_id, order["id"], line))
+    if is_member:
         award_loyalty_points(member_id, total_cents)
-    print(f"Order {order_code} finalized. Total: ${total_cents / 100:.2f}")
-    return order
+    count("sales")
+    emit("sale.finalized", "Order {order_code} finalized. Total: ${total:.2f}",
+         order_code=order["order_code"], member_id=member_id, total=total_cents / 100)
+    return order, items
+
+
+# finalize_sales(carts, promotions=None) -> list of results
+@timed("finalize_sales")
+def finalize_sales(carts, promotions=None):
+    """Finalize a batch of (cart, member_id) pairs without console output.
+
+    Returns one result per cart, in order: {"ok": True, "order": order} or
+    {"ok": False, "error": reason}. Stock is reserved cart by cart against the
+    whole batch, so a cart that would oversell fails on its own.
+    """
+    results = []
+    pending = []
+    for cart, member_id in carts:
+        if not cart:
+            results.append({"ok": False, "error": "Cart is empty."})
+            continue
+        needed, error = _cart_demand(cart)
+        if error:
+            results.append({"ok": False, "error": error})
+            continue
+        pending.append((len(results), cart, member_id, needed))
+        results.append(None)
+
+    accepted = []
+    shorts = inventory_movements.remove_batch([needed for _, _, _, needed in pending])
+    for (slot, cart, member_id, _), short_sku in zip(pending, shorts):
+        if short_sku is not None:
+            results[slot] = {"ok": False, "error": f"Insufficient stock for {short_sku}."}
+            continue
+        accepted.append((slot, cart, member_id))
+
+    members = {}
+    points = {}
+    totals = []
+    for slot, cart, member_id in accepted:
+        if member_id and member_id not in members:
+            members[member_id] = validate_member_id(member_id)
+        is_member = bool(member_id) and members[member_id]
+        if promotions is not None:
+            tier = customers[member_id].get("tier", "NONE") if is_member else None
+            total_cents = promotions.evaluate(cart, tier)["total_cents"]
+        else:
+            total_cents = calculate_cart_total(cart)
+            if is_member:
+                total_cents -= compute_loyalty_discount(member_id, total_cents)
+        if is_member:
+            points[member_id] = points.get(member_id, 0) + total_cents // 100
+        totals.append(total_cents)
+
+    new_orders = order_ids.extend(range(len(accepted)), lambda order_id, i: {
+        "id": order_id,
+        "order_code": generate_order_code(order_id),
+        "member_id": accepted[i][2],
+        "status": "PAID",
+        "total_cents": totals[i]
+    })
+    lines = [(order["id"], line) for order, (_, cart, _) in zip(new_orders, accepted) for line in cart]
+    order_item_ids.extend(lines, lambda item_id, entry: _order_item(item_id, entry[0], entry[1]))
+    for order, (slot, _, _) in zip(new_orders, accepted):
+        results[slot] = {"ok": True, "order": order}
+
+    with points_lock:
+        for member_id, earned in points.items():
+            customers[member_id]["points"] += earned
+    count("sales", len(new_orders))
+    return results
 
 
 # validate_member_id(member_id) -> bool
 def validate_member_id(member_id):
-    for customer in customers:
-        if customer["member_id"] == member_id:
-            return True
-    return False
+    return member_id in customers
 
 
 # compute_loyalty_discount(member_id, total_cents) -> discount_cents
+LOYALTY_DISCOUNT_RATES = {
+    "NONE": 0.00,
+    "SILVER": 0.05,
+    "GOLD": 0.10
+}
+
 def compute_loyalty_discount(member_id, total_cents):
-    customer = next((c for c in customers if c["member_id"] == member_id), None)
+    customer = customers.get(member_id)
     if customer is None:
         return 0
     tier = customer.get("tier", "NONE")
-    discount_rates = {
-        "NONE": 0.00,
-        "SILVER": 0.05,
-        "GOLD": 0.10
-    }
-    return round(total_cents * discount_rates.get(tier, 0.00))
+    return round(total_cents * LOYALTY_DISCOUNT_RATES.get(tier, 0.00))
 
 
 # award_loyalty_points(member_id, total_cents) -> int
@@ -164,35 +614,48 @@ customers = {
     "CUST456": {"member_id": "CUST456", "name": "Bob", "tier": "SILVER", "points": 400},
 }
 
+points_lock = threading.Lock()
+
+@timed("award_loyalty_points")
 def award_loyalty_points(member_id, total_cents):
     if member_id not in customers:
-        print("Customer not found.")
+        emit("loyalty.unknown_customer", "Customer not found.", member_id=member_id)
         return None
     points_earned = total_cents // 100
-    customers[member_id]["points"] += points_earned
-    print("Added", points_earned, "points to", customers[member_id]["name"])
-    print("Total points now:", customers[member_id]["points"])
-    return customers[member_id]["points"]
+    with points_lock:
+        customers[member_id]["points"] += points_earned
+        total_points = customers[member_id]["points"]
+    emit("loyalty.awarded", "Added {points} points to {name}\nTotal points now: {total_points}",
+         member_id=member_id, name=customers[member_id]["name"], points=points_earned, total_points=total_points)
+    return total_points
 
 
 # validate_return_eligibility(order_id, return_items) -> bool
 def validate_return_eligibility(order_id, return_items):
-    order = next((o for o in orders if o["id"] == order_id), None)
+    order = orders.get(order_id)
     if order is None:
-        print(f"Order {order_id} not found.")
+        emit("return.rejected", "Order {order_id} not found.", order_id=order_id)
         return False
     if order["status"] != "PAID":
-        print(f"Order {order_id} cannot be returned (status: {order['status']}).")
+        emit("return.rejected", "Order {order_id} cannot be returned (status: {status}).",
+             order_id=order_id, status=order["status"])
         return False
+    requested = {}
     for return_item in return_items:
-        sku = return_item["sku"]
         qty = return_item["qty"]
-        order_item = next((oi for oi in order_items if oi["order_id"] == order_id and oi["sku"] == sku), None)
-        if order_item is None:
-            print(f"SKU {sku} not found in order {order_id}.")
+        if not isinstance(qty, int) or qty <= 0:
+            emit("return.rejected", "Quantity for {sku} must be a positive whole number.",
+                 order_id=order_id, sku=return_item["sku"], qty=qty)
+            return False
+        requested[return_item["sku"]] = requested.get(return_item["sku"], 0) + qty
+    for sku, qty in requested.items():
+        if (order_id, sku) not in order_items.lines:
+            emit("return.rejected", "SKU {sku} not found in order {order_id}.", order_id=order_id, sku=sku)
             return False
-        if order_item["qty"] < qty:
-            print(f"Insufficient quantity of {sku} in order. Available: {order_item['qty']}, Requested: {qty}")
+        available = order_items.returnable(order_id, sku)
+        if available < qty:
+            emit("return.rejected", "Insufficient quantity of {sku} in order. Available: {available}, Requested: {qty}",
+                 order_id=order_id, sku=sku, available=available, qty=qty)
             return False
     return True
 
@@ -203,10 +666,16 @@ product_variants = {
     "SHIRT-BLUE-L": {"price_cents": 2700},
 }
 
-order_items = [
-    {"order_id": 1, "sku": "SHIRT-RED-M", "qty": 2},
-    {"order_id": 1, "sku": "SHIRT-BLUE-L", "qty": 1},
-]
+orders = IndexedList(key=lambda o: o["id"])
+
+order_items = OrderItemLog()
+
+order_ids = IdAllocator(orders)
+order_item_ids = IdAllocator(order_items)
+
+# Held from validation until the return's items are recorded, so two
+# concurrent returns cannot both claim the same units
+returns_lock = threading.Lock()
 
 def calculate_refund_total(order_id, return_items):
     total_refund = 0
@@ -216,7 +685,7 @@ def calculate_refund_total(order_id, return_items):
         if sku in product_variants:
             price = product_variants[sku]["price_cents"]
         else:
-            print("SKU not found:", sku)
+            emit("refund.unknown_sku", "SKU not found: {sku}", order_id=order_id, sku=sku)
             continue
         refund_amount = price * qty
         total_refund += refund_amount
@@ -225,40 +694,53 @@ def calculate_refund_total(order_id, return_items):
 
 # process_return(order_id, return_items) -> return_order
 def process_return(order_id, return_items):
-    if not validate_return_eligibility(order_id, return_items):
-        print(f"Return for order {order_id} is not eligible.")
-        return None
-    refund_cents = calculate_refund_total(order_id, return_items)
-    new_return_order_id = len(orders) + 1
-    return_order_code = generate_order_code(new_return_order_id)
-    original_order = next((o for o in orders if o["id"] == order_id), None)
-    member_id = original_order["member_id"] if original_order else None
-    return_order = {
-        "id": new_return_order_id,
-        "order_code": return_order_code,
-        "member_id": member_id,
-        "status": "RETURN",
-        "total_cents": refund_cents
-    }
-    orders.append(return_order)
+    return process_return_with_items(order_id, return_items)[0]
+
+
+# process_return_with_items(order_id, return_items) -> (return_order, items)
+@timed("process_return")
+def process_return_with_items(order_id, return_items):
+    with returns_lock:
+        if not validate_return_eligibility(order_id, return_items):
+            emit("return.rejected", "Return for order {order_id} is not eligible.", order_id=order_id)
+            return None, []
+        refund_cents = calculate_refund_total(order_id, return_items)
+        member_id = orders.get(order_id)["member_id"]
+        return_order = order_ids.append(lambda return_order_id: {
+            "id": return_order_id,
+            "order_code": generate_order_code(return_order_id),
+            "member_id": member_id,
+            "status": "RETURN",
+            "total_cents": refund_cents
+        })
+        items = order_item_ids.extend(return_items,
+                                      lambda item_id, line: _order_item(item_id, return_order["id"], line, order_id))
     for return_item in return_items:
-        sku = return_item["sku"]
-        qty = return_item["qty"]
-        order_item = {
-            "id": len(order_items) + 1,
-            "order_id": new_return_order_id,
-            "sku": sku,
-            "qty": qty
-        }
-        order_items.append(order_item)
-        inventory_movements.append({"sku": sku, "qty_change": qty})
-    print(f"Return order {return_order_code} created. Refund: ${refund_cents / 100:.2f}")
-    return return_order
+        inventory_movements.append(_movement(return_item["sku"], return_item["qty"]))
+    count("returns")
+    emit("return.created", "Return order {order_code} created. Refund: ${refund:.2f}",
+         order_code=return_order["order_code"], order_id=order_id, refund=refund_cents / 100)
+    return return_order, items
 
 #Project 02
 
+_REQUIRED = object()
+
+# _from_rows(cls, rows, fields) -> list
+def _from_rows(cls, rows, fields):
+    """Build instances from trusted rows without re-running __init__ checks."""
+    built = []
+    for row in rows:
+        obj = object.__new__(cls)
+        for field, default in fields:
+            setattr(obj, "_" + field, row[field] if default is _REQUIRED else row.get(field, default))
+        built.append(obj)
+    return built
+
 # class ProductVariant
 class ProductVariant:
+    __slots__ = ("_id", "_sku", "_size", "_color", "_price_cents", "_active")
+
     def __init__(self, id, sku, size, color, price_cents, active=True):
         if not sku or not isinstance(price_cents, int) or price_cents < 0:
             raise ValueError("Invalid product data")
@@ -270,6 +752,17 @@ class ProductVariant:
         self._price_cents = price_cents
         self._active = active
 
+    @classmethod
+    def from_rows(cls, rows):
+        return _from_rows(cls, rows, (
+            ("id", _REQUIRED),
+            ("sku", _REQUIRED),
+            ("size", _REQUIRED),
+            ("color", _REQUIRED),
+            ("price_cents", _REQUIRED),
+            ("active", True),
+        ))
+
     @property
     def sku(self):
         return self._sku
@@ -294,6 +787,8 @@ class ProductVariant:
 
 # class InventoryMovement
 class InventoryMovement:
+    __slots__ = ("_id", "_sku", "_qty_change")
+
     def __init__(self, id, sku, qty_change):
         if not sku or not isinstance(qty_change, int):
             raise ValueError("Invalid inventory movement data")
@@ -302,6 +797,14 @@ class InventoryMovement:
         self._sku = sku
         self._qty_change = qty_change
 
+    @classmethod
+    def from_rows(cls, rows):
+        return _from_rows(cls, rows, (
+            ("id", _REQUIRED),
+            ("sku", _REQUIRED),
+            ("qty_change", _REQUIRED),
+        ))
+
     @property
     def sku(self):
         return self._sku
@@ -317,6 +820,8 @@ class InventoryMovement:
 
 # class Customer
 class Customer:
+    __slots__ = ("_id", "_member_id", "_name", "_tier", "_points")
+
     def __init__(self, id, member_id, name, tier, points=0):
         if not isinstance(id, int) or id <= 0:
             raise ValueError("id must be a positive int")
@@ -334,6 +839,16 @@ class Customer:
         self._tier = tier
         self._points = points
 
+    @classmethod
+    def from_rows(cls, rows):
+        return _from_rows(cls, rows, (
+            ("id", _REQUIRED),
+            ("member_id", _REQUIRED),
+            ("name", _REQUIRED),
+            ("tier", _REQUIRED),
+            ("points", 0),
+        ))
+
     @property
     def id(self):
         return self._id
@@ -394,6 +909,8 @@ class Customer:
 
 # class Order
 class Order:
+    __slots__ = ("_id", "_order_code", "_member_id", "_status", "_total_cents")
+
     def __init__(self, id, order_code, member_id, status, total_cents=0):
         if not isinstance(id, int) or id <= 0:
             raise ValueError("id must be a positive int")
@@ -411,6 +928,16 @@ class Order:
         self._status = status
         self._total_cents = total_cents
 
+    @classmethod
+    def from_rows(cls, rows):
+        return _from_rows(cls, rows, (
+            ("id", _REQUIRED),
+            ("order_code", _REQUIRED),
+            ("member_id", _REQUIRED),
+            ("status", _REQUIRED),
+            ("total_cents", 0),
+        ))
+
     @property
     def id(self):
         return self._id
@@ -476,6 +1003,8 @@ from abc import ABC, abstractmethod
 # Abstract Product & Subclasses
 
 class AbstractProduct(ABC):
+    __slots__ = ("_sku", "_price_cents")
+
     def __init__(self, sku, price_cents):
         self._sku = sku
         self._price_cents = price_cents
@@ -484,6 +1013,14 @@ class AbstractProduct(ABC):
     def get_description(self):
         pass
 
+    @property
+    def sku(self):
+        return self._sku
+
+    @property
+    def price_cents(self):
+        return self._price_cents
+
     def get_price_dollars(self):
         return self._price_cents / 100.0
 
@@ -491,6 +1028,8 @@ class AbstractProduct(ABC):
         return f"{self._sku} - ${self.get_price_dollars():.2f}"
 
 class Shirt(AbstractProduct):
+    __slots__ = ("_size", "_color")
+
     def __init__(self, sku, price_cents, size, color):
         super().__init__(sku, price_cents)
         self._size = size
@@ -500,6 +1039,8 @@ class Shirt(AbstractProduct):
         return f"{self._color} Shirt (Size {self._size})"
 
 class Mug(AbstractProduct):
+    __slots__ = ("_capacity_oz",)
+
     def __init__(self, sku, price_cents, capacity_oz):
         super().__init__(sku, price_cents)
         self._capacity_oz = capacity_oz
@@ -510,41 +1051,119 @@ class Mug(AbstractProduct):
 
 # Cart Class
 class Cart:
+    """Cart with one line per SKU and a running total.
+
+    Iterating a Cart yields {"sku", "price_cents", "qty"} lines, the same
+    shape scan_item builds, so finalize_sale accepts a Cart directly. Change
+    quantities through the cart methods so the total stays in step.
+    """
+
+    __slots__ = ("_lines", "_products", "_total_cents")
+
     def __init__(self):
-        self.items = []  
+        self._lines = {}
+        self._products = {}
+        self._total_cents = 0
+
     def add_item(self, product, qty):
-        self.items.append((product, qty))
+        self.add_line(product.sku, product.price_cents, qty, product)
+
+    def add_line(self, sku, price_cents, qty=1, product=None):
+        line = self._lines.get(sku)
+        if line is None:
+            line = self._lines[sku] = {"sku": sku, "price_cents": price_cents, "qty": 0}
+        if product is not None:
+            self._products[sku] = product
+        line["qty"] += qty
+        self._total_cents += line["price_cents"] * qty
+
+    def set_quantity(self, sku, qty):
+        line = self._lines[sku]
+        if qty <= 0:
+            self.remove_item(sku)
+            return
+        self._total_cents += line["price_cents"] * (qty - line["qty"])
+        line["qty"] = qty
+
+    def remove_item(self, sku):
+        line = self._lines.pop(sku)
+        self._products.pop(sku, None)
+        self._total_cents -= line["price_cents"] * line["qty"]
+
+    @property
+    def items(self):
+        return [(self._products.get(sku), line["qty"]) for sku, line in self._lines.items()]
+
+    def __iter__(self):
+        return iter(self._lines.values())
+
+    def __len__(self):
+        return len(self._lines)
 
     def total_price_cents(self):
-        return sum(prod._price_cents * qty for prod, qty in self.items)
+        return self._total_cents
 
     def print_receipt(self):
-        for prod, qty in self.items:
-            print(f"{prod.get_description()} x {qty} - ${prod.get_price_dollars() * qty:.2f}")
+        for sku, line in self._lines.items():
+            product = self._products.get(sku)
+            description = product.get_description() if product else sku
+            print(f"{description} x {line['qty']} - ${line['price_cents'] * line['qty'] / 100:.2f}")
         print(f"Total: ${self.total_price_cents() / 100:.2f}")
 
+
+# cart_data_to_dict(cart) -> list
+def cart_data_to_dict(cart):
+    """Copy a Cart into the plain list-of-lines cart finalize_sale takes."""
+    return [dict(line) for line in cart]
+
 # Reward Strategy Pattern
 class RewardStrategy(ABC):
+    # Strategies paying a flat multiple of whole dollars set this, so bulk
+    # runs can compute points without a calculate() call per order. A
+    # subclass that overrides calculate() below the class setting it gets
+    # the per-order path
+    multiplier = None
+
     @abstractmethod
     def calculate(self, order):
         pass
 
+    def flat_multiplier(self):
+        mro = type(self).__mro__
+        declared = next(i for i, cls in enumerate(mro) if "multiplier" in vars(cls))
+        calculated = next(i for i, cls in enumerate(mro) if "calculate" in vars(cls))
+        return self.multiplier if calculated >= declared else None
+
+    def calculate_bulk(self, orders):
+        multiplier = self.flat_multiplier()
+        if multiplier is None:
+            return [self.calculate(order) for order in orders]
+        return [order.total_cents // 100 * multiplier for order in orders]
+
 class BronzeReward(RewardStrategy):
+    multiplier = 1
+
     def calculate(self, order):
         return order.total_cents // 100
 
 class GoldReward(BronzeReward):
+    multiplier = 2
+
     def calculate(self, order):
         base = super().calculate(order)
         return base * 2
 
 class PlatinumReward(RewardStrategy):
+    multiplier = 3
+
     def calculate(self, order):
         return (order.total_cents // 100) * 3
 
 
 # Customer and Order Classes
 class Customer:
+    __slots__ = ("_id", "_member_id", "_name", "_tier", "_points")
+
     def __init__(self, id, member_id, name, tier, points=0):
         self._id = id
         self._member_id = member_id
@@ -552,11 +1171,23 @@ class Customer:
         self._tier = tier
         self._points = points
 
+    @classmethod
+    def from_rows(cls, rows):
+        return _from_rows(cls, rows, (
+            ("id", _REQUIRED),
+            ("member_id", _REQUIRED),
+            ("name", _REQUIRED),
+            ("tier", _REQUIRED),
+            ("points", 0),
+        ))
+
     @property
     def member_id(self): return self._member_id
     @property
     def name(self): return self._name
     @property
+    def tier(self): return self._tier
+    @property
     def points(self): return self._points
     def add_points(self, n): self._points += n
 
@@ -564,6 +1195,8 @@ class Customer:
         return f"{self._name} [{self._tier}] - {self._points} pts"
 
 class Order:
+    __slots__ = ("_id", "_order_code", "_member_id", "_status", "_total_cents")
+
     def __init__(self, id, order_code, member_id, status, total_cents=0):
         self._id = id
         self._order_code = order_code
@@ -571,6 +1204,16 @@ class Order:
         self._status = status
         self._total_cents = total_cents
 
+    @classmethod
+    def from_rows(cls, rows):
+        return _from_rows(cls, rows, (
+            ("id", _REQUIRED),
+            ("order_code", _REQUIRED),
+            ("member_id", _REQUIRED),
+            ("status", _REQUIRED),
+            ("total_cents", 0),
+        ))
+
     @property
     def order_code(self): return self._order_code
     @property
@@ -581,10 +1224,19 @@ class Order:
 # Loyalty Program Class
 
 class LoyaltyProgram:
-    def __init__(self, strategy: RewardStrategy):
+    TIER_STRATEGIES = {
+        "Bronze": BronzeReward(),
+        "Silver": BronzeReward(),
+        "Gold": GoldReward(),
+        "Platinum": PlatinumReward(),
+    }
+
+    def __init__(self, strategy: RewardStrategy, tier_strategies=None):
         self.strategy = strategy
+        self.tier_strategies = self.TIER_STRATEGIES if tier_strategies is None else tier_strategies
         self.customers = {}
         self.orders = {}
+        self.credited = set()
 
     def add_customer(self, customer):
         self.customers[customer.member_id] = customer
@@ -598,4 +1250,37 @@ class LoyaltyProgram:
 
         points = self.strategy.calculate(order) 
         customer.add_points(points)
+        self.credited.add(order_code)
         return points
+
+    def strategy_for(self, customer):
+        return self.tier_strategies.get(customer.tier, self.strategy)
+
+    def apply_points_bulk(self, order_codes=None):
+        """Credit many orders using each customer's tier strategy.
+
+        Points are computed per strategy in one pass and added once per
+        customer. Orders already credited, by either method, are skipped, so
+        re-running a settlement is harmless. Every order and customer is looked
+        up before anything changes, so a missing one raises with nothing
+        credited. Returns {member_id: points added}.
+        """
+        codes = self.orders if order_codes is None else order_codes
+        pending = {}
+        by_strategy = {}
+        for code in codes:
+            if code in self.credited or code in pending:
+                continue
+            order = self.orders[code]
+            strategy = self.strategy_for(self.customers[order.member_id])
+            pending[code] = order
+            by_strategy.setdefault(strategy, []).append(order)
+
+        increments = {}
+        for strategy, orders in by_strategy.items():
+            for order, points in zip(orders, strategy.calculate_bulk(orders)):
+                increments[order.member_id] = increments.get(order.member_id, 0) + points
+        for member_id, points in increments.items():
+            self.customers[member_id].add_points(points)
+        self.credited.update(pending)
+        return increments
@@ -0,0 +1,219 @@
+import tempfile
+import threading
+import unittest
+
+import data_persistence
+import sqlite_persistence
+from store_system import IdAllocator
+
+
+class TestDataPersistence(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(data_persistence.set_data_dir, data_persistence.data_dir)
+        data_persistence.set_data_dir(self.tmp.name)
+
+    def test_load_all_replays_journal_after_snapshot(self):
+        data_persistence.save_all([{"sku": "SHIRT-RED-M", "qty_change": 5}], {}, [], [])
+        data_persistence.save_sale(
+            {"id": 1, "order_code": "ORD-0001", "member_id": None, "status": "PAID", "total_cents": 2500},
+            [{"id": 1, "order_id": 1, "sku": "SHIRT-RED-M", "qty": 1}],
+            [{"sku": "SHIRT-RED-M", "qty_change": -1}],
+        )
+        movements, customers, orders, order_items = data_persistence.load_all()
+        self.assertEqual([m["qty_change"] for m in movements], [5, -1])
+        self.assertEqual([o["order_code"] for o in orders], ["ORD-0001"])
+        self.assertEqual(len(order_items), 1)
+
+    def test_save_all_starts_new_journal(self):
+        data_persistence.append_records([{"sku": "SHIRT-RED-M", "qty_change": 5}],
+                                        data_persistence.inventory_journal)
+        movements = data_persistence.load_all()[0]
+        data_persistence.save_all(movements, {}, [], [])
+        self.assertFalse(data_persistence.inventory_journal.exists())
+        self.assertEqual(data_persistence.load_all()[0], movements)
+
+    def test_journal_replay_skips_only_corrupt_lines(self):
+        journal = data_persistence.inventory_journal
+        journal.parent.mkdir(parents=True, exist_ok=True)
+        journal.write_text('{"sku": "A", "qty_change": 1}\n{"sku": "A", "qty_ch\n'
+                           '{"sku": "A", "qty_change": 2}\n{"sku": "A", "qty_change": 4}\n{"sku": "A"')
+        self.assertEqual([m["qty_change"] for m in data_persistence.iter_journal(journal)], [1, 2, 4])
+        with self.assertRaises(ValueError):
+            list(data_persistence.iter_journal(journal, strict=True))
+
+        journal.write_text('{"sku": "A", "qty_change": 1}\n{"sku": "A"')
+        self.assertEqual(len(list(data_persistence.iter_journal(journal, strict=True))), 1)
+
+    def test_append_after_torn_tail_starts_a_new_line(self):
+        journal = data_persistence.inventory_journal
+        data_persistence.append_records([{"id": 1}], journal)
+        with open(journal, "a") as f:
+            f.write('{"id": 2, "sk')
+        data_persistence.append_records([{"id": 3}], journal)
+        data_persistence.append_records([{"id": 4}], journal)
+        self.assertEqual(data_persistence.load_journal(journal), [{"id": 1}, {"id": 3}, {"id": 4}])
+        journal.write_text('{"id": 5')
+        data_persistence.append_records([{"id": 6}], journal)
+        self.assertEqual(data_persistence.load_journal(journal), [{"id": 6}])
+
+    def test_failed_save_is_logged(self):
+        with self.assertLogs("data_persistence", level="ERROR") as logs:
+            data_persistence.save_data({"bad": object()}, data_persistence.customers_file)
+        self.assertIn("customers.json", logs.output[0])
+
+    def test_iter_data_streams_records_across_chunks(self):
+        movements = [{"sku": f"SKU-{i}", "qty_change": i * 11} for i in range(50)]
+        customers = {"CUST123": {"name": "Alice", "points": 1500}, "CUST456": {"name": "Bob", "points": 4}}
+        data_persistence.save_all(movements, customers, [], [])
+        self.assertEqual(list(data_persistence.iter_data(data_persistence.inventory_file, chunk_size=7)), movements)
+        self.assertEqual(dict(data_persistence.iter_data(data_persistence.customers_file, chunk_size=5)), customers)
+        self.assertEqual(list(data_persistence.iter_data(data_persistence.orders_file, chunk_size=3)), [])
+
+    def test_load_stock_levels_folds_snapshot_and_journal(self):
+        data_persistence.save_all([{"sku": "SHIRT-RED-M", "qty_change": 5}], {}, [], [])
+        data_persistence.append_records([{"sku": "SHIRT-RED-M", "qty_change": -2}],
+                                        data_persistence.inventory_journal)
+        self.assertEqual(data_persistence.load_stock_levels(), {"SHIRT-RED-M": 3})
+
+    def test_compact_inventory_folds_history_into_snapshot(self):
+        data_persistence.save_all([{"sku": "SHIRT-RED-M", "qty_change": 5},
+                                   {"sku": "SHIRT-BLUE-L", "qty_change": 3}], {}, [], [])
+        data_persistence.append_records([{"sku": "SHIRT-RED-M", "qty_change": -2},
+                                         {"sku": "SHIRT-BLUE-L", "qty_change": -1}],
+                                        data_persistence.inventory_journal)
+        data_persistence.compact_inventory(keep=1)
+        movements = data_persistence.load_all()[0]
+        self.assertEqual(movements, [{"sku": "SHIRT-RED-M", "qty_change": 3, "snapshot": True, "ts": 0.0},
+                                     {"sku": "SHIRT-BLUE-L", "qty_change": 3, "snapshot": True, "ts": 0.0},
+                                     {"sku": "SHIRT-BLUE-L", "qty_change": -1}])
+        self.assertEqual(len(data_persistence.load_journal(data_persistence.inventory_archive)), 3)
+        self.assertEqual(data_persistence.load_stock_levels(), {"SHIRT-RED-M": 3, "SHIRT-BLUE-L": 2})
+
+    def test_compaction_keeps_records_appended_meanwhile(self):
+        data_persistence.append_records([{"sku": "SHIRT-RED-M", "qty_change": 1}] * 2000,
+                                        data_persistence.inventory_journal)
+        writer = threading.Thread(target=lambda: [data_persistence.append_records(
+            [{"sku": "SHIRT-RED-M", "qty_change": 1}], data_persistence.inventory_journal) for _ in range(1000)])
+        writer.start()
+        while writer.is_alive():
+            data_persistence.compact_inventory()
+        writer.join()
+        self.assertEqual(data_persistence.load_stock_levels(), {"SHIRT-RED-M": 3000})
+
+    def test_compaction_aborts_on_unreadable_history(self):
+        data_persistence.save_all([{"sku": "SHIRT-RED-M", "qty_change": n} for n in range(1, 101)], {}, [], [])
+        data_persistence.append_records([{"sku": "SHIRT-RED-M", "qty_change": -1}],
+                                        data_persistence.inventory_journal)
+        text = data_persistence.inventory_file.read_text()
+        middle = len(text) // 2
+        data_persistence.inventory_file.write_text(text[:middle] + "\x00" + text[middle + 1:])
+        with self.assertRaises(ValueError):
+            data_persistence.compact_inventory()
+        self.assertEqual(data_persistence.inventory_file.read_text()[:middle], text[:middle])
+        self.assertTrue(data_persistence.inventory_journal.exists())
+        self.assertFalse(data_persistence.inventory_archive.exists())
+
+    def test_failed_snapshot_write_keeps_journal(self):
+        data_persistence.append_records([{"sku": "SHIRT-RED-M", "qty_change": 5}],
+                                        data_persistence.inventory_journal)
+        data_persistence.inventory_file.mkdir()
+        with self.assertLogs("data_persistence", "ERROR"):
+            self.assertFalse(data_persistence.save_all([], {}, [], []))
+        self.assertEqual(data_persistence.load_journal(data_persistence.inventory_journal),
+                         [{"sku": "SHIRT-RED-M", "qty_change": 5}])
+        with self.assertRaises(OSError):
+            data_persistence.compact_inventory()
+        self.assertTrue(data_persistence.inventory_journal.exists())
+
+    def test_data_dir_is_created_by_first_write(self):
+        data_persistence.set_data_dir(f"{self.tmp.name}/store")
+        self.assertEqual(data_persistence.load_all(), ([], {}, [], []))
+        self.assertFalse(data_persistence.data_dir.exists())
+        data_persistence.save_all([], {}, [], [])
+        self.assertTrue(data_persistence.customers_file.exists())
+
+    def test_lazy_collections_load_on_first_access_and_stay_cached(self):
+        data_persistence.save_all([{"sku": "SHIRT-RED-M", "qty_change": 5}],
+                                  {"CUST123": {"name": "Alice", "points": 1500}}, [], [])
+        self.assertFalse(data_persistence.lazy_customers.loaded)
+        self.assertEqual(data_persistence.lazy_customers["CUST123"]["points"], 1500)
+        self.assertTrue(data_persistence.lazy_customers.loaded)
+        self.assertFalse(data_persistence.lazy_inventory.loaded)
+
+        data_persistence.customers_file.write_text("{}")
+        self.assertIn("CUST123", data_persistence.lazy_customers)
+
+        data_persistence.save_sale({"id": 1, "order_code": "ORD-0001", "member_id": None, "status": "PAID",
+                                    "total_cents": 2500}, [], [{"sku": "SHIRT-RED-M", "qty_change": -1}])
+        self.assertFalse(data_persistence.lazy_customers.loaded)
+        self.assertEqual(len(data_persistence.lazy_inventory), 2)
+        self.assertEqual([o["id"] for o in data_persistence.lazy_orders], [1])
+
+    def test_block_id_sources_lease_disjoint_ids(self):
+        register_a = data_persistence.BlockIdSource("orders", block_size=3, floor=5)
+        register_b = data_persistence.BlockIdSource("orders", block_size=3)
+        self.assertEqual((register_a(), register_b()), (5, 8))
+        self.assertEqual([register_a() for _ in range(3)], [6, 7, 11])
+        self.assertEqual(register_b(), 9)
+        self.assertEqual(data_persistence.lease_ids("orders", 1), 14)
+
+        orders = []
+        allocator = IdAllocator(orders, source=data_persistence.BlockIdSource("orders", block_size=2))
+        allocator.append(lambda order_id: {"id": order_id})
+        allocator.extend("ab", lambda order_id, code: {"id": order_id, "code": code})
+        self.assertEqual([o["id"] for o in orders], [15, 16, 17])
+
+    def test_lease_ids_refuses_to_run_without_a_file_lock(self):
+        self.addCleanup(setattr, data_persistence, "fcntl", data_persistence.fcntl)
+        self.addCleanup(setattr, data_persistence, "msvcrt", data_persistence.msvcrt)
+        data_persistence.fcntl = data_persistence.msvcrt = None
+        with self.assertRaises(RuntimeError):
+            data_persistence.lease_ids("order_items", 10)
+
+
+class TestSqlitePersistence(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(data_persistence.set_data_dir, data_persistence.data_dir)
+        self.addCleanup(sqlite_persistence.close)
+        data_persistence.set_data_dir(self.tmp.name)
+
+    def test_save_all_round_trips_every_collection(self):
+        movements = [{"sku": "SHIRT-RED-M", "qty_change": 3, "snapshot": True},
+                     {"sku": "SHIRT-RED-M", "qty_change": -1}]
+        customers = {"CUST123": {"member_id": "CUST123", "name": "Alice", "tier": "GOLD", "points": 1500}}
+        orders = [{"id": 1, "order_code": "ORD-0001", "member_id": "CUST123", "status": "PAID", "total_cents": 2250}]
+        order_items = [{"id": 1, "order_id": 1, "sku": "SHIRT-RED-M", "qty": 1}]
+        sqlite_persistence.save_all(movements, customers, orders, order_items)
+        self.assertEqual(sqlite_persistence.load_all(), (movements, customers, orders, order_items))
+        self.assertEqual(sqlite_persistence.connect().execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_save_sale_updates_point_queries(self):
+        sqlite_persistence.save_all([{"sku": "SHIRT-RED-M", "qty_change": 5}], {}, [], [])
+        sqlite_persistence.save_sale(
+            {"id": 1, "order_code": "ORD-0001", "member_id": None, "status": "PAID", "total_cents": 5000},
+            [{"id": 1, "order_id": 1, "sku": "SHIRT-RED-M", "qty": 2}],
+            [{"sku": "SHIRT-RED-M", "qty_change": -2}],
+        )
+        self.assertEqual(sqlite_persistence.stock_level("SHIRT-RED-M"), 3)
+        self.assertEqual(sqlite_persistence.stock_level("MUG-BLACK"), 0)
+        self.assertEqual(sqlite_persistence.items_for_order(1), [{"id": 1, "order_id": 1, "sku": "SHIRT-RED-M", "qty": 2}])
+        self.assertEqual(sqlite_persistence.get_order(1)["total_cents"], 5000)
+
+    def test_failed_sale_is_rolled_back(self):
+        sqlite_persistence.save_all([{"sku": "SHIRT-RED-M", "qty_change": 5}], {}, [], [])
+        with self.assertRaises(KeyError):
+            sqlite_persistence.save_sale({"id": 1, "status": "PAID", "total_cents": 0},
+                                         [{"order_id": 1, "sku": "SHIRT-RED-M"}],
+                                         [{"sku": "SHIRT-RED-M", "qty_change": -1}])
+        self.assertEqual(sqlite_persistence.stock_level("SHIRT-RED-M"), 5)
+        self.assertIsNone(sqlite_persistence.get_order(1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,30 @@
+import asyncio
+import json
+import tempfile
+import threading
+import time
+import types
 import unittest
 from store_system import Shirt, Mug, Cart, Customer, Order, GoldReward, LoyaltyProgram, inventory_movements, remove_from_inventory
+from store_system import (product_variants, customers, orders, order_items, scan_item, finalize_sale,
+                          process_return, calculate_stock_level, finalize_sales)
+from pos_service import PosServer, RegisterClient, simulate_registers
+from sharded_inventory import ShardedInventory, shard_for
+import instrumentation
+import profiling
+import store_system
+from promotions import PromotionEngine, SkuMarkdown, TierDiscount
 
 class TestIntegration(unittest.TestCase):
 
+    def setUp(self):
+        inventory_movements.clear()
+        inventory_movements.append({"sku": "SHIRT-RED-M", "qty_change": 5})
+        orders.clear()
+        order_items.clear()
+        product_variants["SHIRT-RED-M"] = {"sku": "SHIRT-RED-M", "price_cents": 2500, "active": True}
+        customers["CUST123"] = {"member_id": "CUST123", "name": "Alice", "tier": "GOLD", "points": 0}
+
     def test_cart_order_loyalty_flow(self):
         cart = Cart()
         shirt = Shirt("SHIRT-RED-M", 2500, "M", "Red")
@@ -25,20 +47,228 @@ class TestIntegration(unittest.TestCase):
         self.assertEqual(c.points, 124)
 
     def test_finalize_sale_reduces_inventory(self):
-        # TODO: add test that calls finalize_sale() and checks inventory
-        pass
+        order = finalize_sale([{"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 2}])
+        self.assertEqual(order["status"], "PAID")
+        self.assertEqual(calculate_stock_level("SHIRT-RED-M"), 3)
 
     def test_process_return_increases_inventory(self):
-        # TODO: create an order, return it, and check stock level goes up
-        pass
+        order = finalize_sale([{"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 2}])
+        return_order = process_return(order["id"], [{"sku": "SHIRT-RED-M", "qty": 1}])
+        self.assertEqual(return_order["status"], "RETURN")
+        self.assertEqual(return_order["total_cents"], 2500)
+        self.assertEqual(calculate_stock_level("SHIRT-RED-M"), 4)
+        self.assertIs(orders.get(return_order["id"]), return_order)
+
+    def test_stock_level_at_earlier_point(self):
+        before = time.time() - 0.001
+        finalize_sale([{"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 2}])
+        self.assertEqual(store_system.stock_level_at("SHIRT-RED-M", ts=before), 5)
+        self.assertEqual(store_system.stock_level_at("SHIRT-RED-M", position=1), 5)
+        self.assertEqual(store_system.stock_level_at("SHIRT-RED-M", ts=time.time()), 3)
+        self.assertEqual(store_system.stock_level_at("SHIRT-RED-M"), 3)
+
+    def test_returns_cannot_exceed_units_sold(self):
+        order = finalize_sale([{"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 2}])
+        self.assertIsNotNone(process_return(order["id"], [{"sku": "SHIRT-RED-M", "qty": 1}]))
+        self.assertIsNone(process_return(order["id"], [{"sku": "SHIRT-RED-M", "qty": 1},
+                                                       {"sku": "SHIRT-RED-M", "qty": 1}]))
+        self.assertIsNotNone(process_return(order["id"], [{"sku": "SHIRT-RED-M", "qty": 1}]))
+        self.assertIsNone(process_return(order["id"], [{"sku": "SHIRT-RED-M", "qty": 1}]))
+        self.assertEqual(order_items.lines[(order["id"], "SHIRT-RED-M")], {"sold": 2, "returned": 2})
+        self.assertEqual(calculate_stock_level("SHIRT-RED-M"), 5)
+
+    def test_returns_reject_non_positive_quantities(self):
+        order = finalize_sale([{"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 1}])
+        for qty in (-3, 0, 1.5, "1"):
+            self.assertIsNone(process_return(order["id"], [{"sku": "SHIRT-RED-M", "qty": qty}]))
+        self.assertEqual(order_items.returnable(order["id"], "SHIRT-RED-M"), 1)
+        self.assertEqual(calculate_stock_level("SHIRT-RED-M"), 4)
+        self.assertIsNone(process_return(order["id"], [{"sku": "SHIRT-RED-M", "qty": 2}]))
+
+    def test_concurrent_returns_claim_each_unit_once(self):
+        order = finalize_sale([{"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 3}])
+        results = []
+        workers = [threading.Thread(target=lambda: results.append(
+            process_return(order["id"], [{"sku": "SHIRT-RED-M", "qty": 1}]))) for _ in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(sum(r is not None for r in results), 3)
+        self.assertEqual(order_items.returnable(order["id"], "SHIRT-RED-M"), 0)
+
+    def test_sharded_inventory_commits_carts_across_shards(self):
+        product_variants["SHIRT-BLUE-L"] = {"sku": "SHIRT-BLUE-L", "price_cents": 2700, "active": True}
+        engine = ShardedInventory(list(inventory_movements) + [{"sku": "SHIRT-BLUE-L", "qty_change": 1}], shards=2)
+        self.addCleanup(engine.close)
+        self.addCleanup(setattr, store_system, "inventory_movements", store_system.inventory_movements)
+        store_system.inventory_movements = engine
+        self.assertNotEqual(shard_for("SHIRT-RED-M", 2), shard_for("SHIRT-BLUE-L", 2))
+
+        self.assertIsNone(finalize_sale([{"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 2},
+                                         {"sku": "SHIRT-BLUE-L", "price_cents": 2700, "qty": 2}]))
+        self.assertEqual(engine.totals(), {"SHIRT-RED-M": 5, "SHIRT-BLUE-L": 1})
+        order = finalize_sale([{"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 2},
+                               {"sku": "SHIRT-BLUE-L", "price_cents": 2700, "qty": 1}])
+        self.assertEqual(order["total_cents"], 7700)
+        self.assertEqual(store_system.add_to_inventory("SHIRT-BLUE-L", 4)["new_qty"], 4)
+        self.assertIsNone(remove_from_inventory("SHIRT-RED-M", 4))
+        self.assertEqual(calculate_stock_level("SHIRT-RED-M"), 3)
+
+    def test_sharded_removal_failure_releases_every_shard(self):
+        engine = ShardedInventory([{"sku": "SHIRT-RED-M", "qty_change": 5, "ts": 10.0},
+                                   {"sku": "SHIRT-BLUE-L", "qty_change": 5, "ts": 10.0}], shards=2)
+        self.addCleanup(engine.close)
+        with self.assertRaises(RuntimeError):
+            engine.remove_many({"SHIRT-RED-M": 2, "SHIRT-BLUE-L": "two"})
+        self.assertEqual(engine.on_hand("SHIRT-RED-M"), 5)
+        self.assertIsNone(engine.remove_many({"SHIRT-RED-M": 5, "SHIRT-BLUE-L": 5}))
+        self.assertEqual(engine.totals(), {"SHIRT-RED-M": 0, "SHIRT-BLUE-L": 0})
+
+        self.addCleanup(setattr, store_system, "inventory_movements", store_system.inventory_movements)
+        store_system.inventory_movements = engine
+        self.assertEqual(store_system.stock_level_at("SHIRT-RED-M", ts=10.0), 5)
+        with self.assertRaises(RuntimeError):
+            store_system.stock_level_at("SHIRT-RED-M", ts=9.0)
+        # Rows 0 and 1 are the starting stock; the removal was numbered 2
+        # (SHIRT-BLUE-L) and 3 (SHIRT-RED-M) by the engine
+        self.assertEqual(store_system.stock_level_at("SHIRT-RED-M", position=3), 5)
+        self.assertEqual(store_system.stock_level_at("SHIRT-RED-M", position=4), 0)
+        with self.assertRaises(RuntimeError):
+            store_system.stock_level_at("SHIRT-RED-M", position=1)
+
+    def test_sharded_batches_match_the_in_process_ledger(self):
+        batch = [{"SHIRT-RED-M": 2, "SHIRT-BLUE-L": 1}, {"SHIRT-RED-M": 4}, {"SHIRT-BLUE-L": 3},
+                 {"SHIRT-RED-M": 1, "SHIRT-BLUE-L": 1}]
+        rows = [{"sku": "SHIRT-RED-M", "qty_change": 5}, {"sku": "SHIRT-BLUE-L", "qty_change": 4}]
+        ledger = store_system.MovementLog([dict(row) for row in rows])
+        engine = ShardedInventory([dict(row) for row in rows], shards=2)
+        self.addCleanup(engine.close)
+        self.assertEqual(engine.remove_batch(batch), ledger.remove_batch(batch))
+        self.assertEqual(engine.totals(), ledger.stock)
+        self.assertEqual(engine.totals(), {"SHIRT-RED-M": 3, "SHIRT-BLUE-L": 0})
+        skus = ("SHIRT-RED-M", "SHIRT-BLUE-L")
+        self.assertEqual([engine.stock_at(sku, n) for sku in skus for n in range(2, 5)],
+                         [ledger.stock_at(sku, n) for sku in skus for n in range(2, 5)])
 
     def test_discount_applied_for_gold_customer(self):
-        # TODO: simulate gold customer order, verify discount is applied
-        pass
+        order = finalize_sale([{"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 2}], member_id="CUST123")
+        self.assertEqual(order["total_cents"], 4500)
+        self.assertEqual(customers["CUST123"]["points"], 45)
+
+    def test_finalize_sale_with_promotion_engine(self):
+        engine = PromotionEngine([TierDiscount("GOLD", 0.10), SkuMarkdown("SHIRT-RED-M", cents_off=500)])
+        order = finalize_sale([{"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 2}], "CUST123", promotions=engine)
+        self.assertEqual(order["total_cents"], 3600)
+        self.assertEqual(customers["CUST123"]["points"], 36)
 
     def test_scan_item_adds_to_cart_correctly(self):
-        # TODO: use scan_item() to simulate scanning a SKU into the cart
-        pass
+        cart = []
+        scan_item(cart, "SHIRT-RED-M")
+        scan_item(cart, "SHIRT-RED-M")
+        self.assertEqual(cart, [{"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 2}])
+
+    def test_finalize_sale_accepts_scanned_cart_object(self):
+        cart = Cart()
+        scan_item(cart, "SHIRT-RED-M")
+        scan_item(cart, "SHIRT-RED-M")
+        self.assertEqual(cart.total_price_cents(), 5000)
+        order = finalize_sale(cart)
+        self.assertEqual(order["total_cents"], 5000)
+        self.assertEqual(calculate_stock_level("SHIRT-RED-M"), 3)
+
+    def test_finalize_sales_batch(self):
+        line = {"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 2}
+        results = finalize_sales([([line], "CUST123"), ([], None), ([line], None), ([line], None)])
+        self.assertEqual([r["ok"] for r in results], [True, False, True, False])
+        self.assertEqual([r["order"]["order_code"] for r in results if r["ok"]], ["ORD-0001", "ORD-0002"])
+        self.assertEqual(results[0]["order"]["total_cents"], 4500)
+        self.assertEqual(customers["CUST123"]["points"], 45)
+        self.assertEqual(calculate_stock_level("SHIRT-RED-M"), 1)
+        self.assertEqual(len(order_items), 2)
+
+
+    def test_pos_service_serves_pipelined_registers(self):
+        inventory_movements.append({"sku": "SHIRT-RED-M", "qty_change": 95})
+
+        async def run():
+            server = await PosServer(persist=False).start()
+            client = await RegisterClient.connect(port=server.port)
+            replies = await client.pipeline([{"op": "scan", "sku": "SHIRT-RED-M"},
+                                             {"op": "scan", "sku": "SHIRT-RED-M"},
+                                             {"op": "finalize", "member_id": "CUST123"},
+                                             {"op": "stock", "sku": "SHIRT-RED-M"},
+                                             {"op": "nope"}])
+            await client.close()
+            stats = await simulate_registers(port=server.port, registers=20, sales_per_register=3)
+            await server.close()
+            return replies, stats
+
+        replies, stats = asyncio.run(run())
+        self.assertEqual(replies[1]["total_cents"], 5000)
+        self.assertEqual(replies[2]["order"]["total_cents"], 4500)
+        self.assertEqual(replies[3]["qty"], 98)
+        self.assertFalse(replies[4]["ok"])
+        self.assertEqual(stats["sales"], 60)
+        self.assertEqual(calculate_stock_level("SHIRT-RED-M"), 38)
+        self.assertEqual(len(orders), 61)
+
+
+    def test_pos_service_journals_the_item_rows_each_sale_created(self):
+        server = PosServer()
+        session = types.SimpleNamespace(cart=[{"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 2}])
+        order = server.op_finalize(session, {})["order"]
+        server.op_return(session, {"order_id": order["id"], "items": [{"sku": "SHIRT-RED-M", "qty": 1},
+                                                                       {"sku": "SHIRT-RED-M", "qty": 1}]})
+        (_, sold, _), (_, returned, _) = server.pending.get_nowait(), server.pending.get_nowait()
+        self.assertEqual(sold, order_items[:1])
+        self.assertEqual(returned, order_items[1:])
+        self.assertEqual([item["id"] for item in returned], [2, 3])
+
+    def test_events_and_metrics_for_checkout(self):
+        events = []
+        instrumentation.reset()
+        instrumentation.set_sink(lambda event, template, fields: events.append((event, template.format(**fields))))
+        self.addCleanup(instrumentation.set_sink, None)
+        finalize_sale([{"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 9}])
+        finalize_sale([{"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 1}], member_id="CUST123")
+        self.assertEqual(events[0], ("sale.rejected", "Insufficient stock for SHIRT-RED-M. Available: 5, Requested: 9"))
+        self.assertEqual(events[-1], ("sale.finalized", "Order ORD-0001 finalized. Total: $22.50"))
+        snapshot = instrumentation.snapshot()
+        self.assertEqual(snapshot["counters"]["sales"], 1)
+        self.assertEqual(snapshot["latency"]["finalize_sale"]["count"], 2)
+        self.assertEqual(snapshot["latency"]["award_loyalty_points"]["count"], 1)
+
+
+    def test_profiling_samples_and_restores_functions(self):
+        original = store_system.finalize_sale
+        profiling.reset()
+        profiling.enable(every=2, memory=True, targets={store_system: ["finalize_sale", "remove_from_inventory"]})
+        self.addCleanup(profiling.disable)
+        for _ in range(4):
+            store_system.finalize_sale([{"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 1}])
+        profiling.disable()
+        self.assertIs(store_system.finalize_sale, original)
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = profiling.write_reports(tmp)
+            with open(directory / "profile_summary.json") as f:
+                summary = json.load(f)
+            self.assertTrue((directory / "profile_store_system.finalize_sale.txt").exists())
+        self.assertEqual(summary["store_system.finalize_sale"]["calls"], 4)
+        self.assertEqual(summary["store_system.finalize_sale"]["samples"], 2)
+        self.assertEqual(summary["store_system.finalize_sale"]["memory"]["samples"], 2)
+
+    def test_profiling_defaults_cover_the_pos_checkout_path(self):
+        profiling.reset()
+        profiling.enable(every=1)
+        self.addCleanup(profiling.disable)
+        server = PosServer(persist=False)
+        session = types.SimpleNamespace(cart=[{"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 1}])
+        order = server.op_finalize(session, {})["order"]
+        server.op_return(session, {"order_id": order["id"], "items": [{"sku": "SHIRT-RED-M", "qty": 1}]})
+        profiling.disable()
+        self.assertEqual(profiling.summary()["store_system.finalize_sale_with_items"]["samples"], 1)
+        self.assertEqual(profiling.summary()["store_system.process_return_with_items"]["samples"], 1)
 
 
 if __name__ == "__main__":
@@ -1,5 +1,13 @@
+import os
+import tempfile
+import threading
 import unittest
-from store_system import Shirt, Mug, Cart, Customer, Order, GoldReward, LoyaltyProgram
+from store_system import Shirt, Mug, Cart, Customer, Order, GoldReward, LoyaltyProgram, MovementLog, IdAllocator
+import store_system
+from movement_store import MovementColumns, BinaryMovementFile
+from instrumentation import LatencyHistogram
+import analytics
+from promotions import PromotionEngine, TierDiscount, SkuMarkdown, CategoryMarkdown, BundleDeal
 
 class TestProductClasses(unittest.TestCase):
 
@@ -14,6 +22,26 @@ class TestProductClasses(unittest.TestCase):
         self.assertEqual(mug.get_price_dollars(), 12.00)
 
 
+class TestSlottedClasses(unittest.TestCase):
+
+    def test_instances_have_no_dict(self):
+        for obj in (Shirt("SHIRT-RED-M", 2500, "M", "Red"), Mug("MUG-WHITE-12", 1200, 12), Cart(),
+                    Customer(1, "M001", "Alice", "Gold"), Order(1, "O100", "M001", "Delivered"),
+                    store_system.ProductVariant(1, "SHIRT-RED-M", "M", "Red", 2500),
+                    store_system.InventoryMovement(1, "SHIRT-RED-M", 5)):
+            self.assertFalse(hasattr(obj, "__dict__"), type(obj).__name__)
+
+    def test_from_rows_builds_trusted_rows(self):
+        customers = Customer.from_rows([{"id": 1, "member_id": "M001", "name": "Alice", "tier": "Gold"}])
+        self.assertEqual(str(customers[0]), "Alice [Gold] - 0 pts")
+        variants = store_system.ProductVariant.from_rows(
+            [{"id": 1, "sku": "SHIRT-RED-M", "size": "M", "color": "Red", "price_cents": 2500}])
+        self.assertTrue(variants[0].is_active)
+        self.assertEqual(str(variants[0]), "Red Shirt (M) - $25.00")
+        with self.assertRaises(KeyError):
+            store_system.InventoryMovement.from_rows([{"id": 1, "sku": "SHIRT-RED-M"}])
+
+
 class TestCart(unittest.TestCase):
 
     def test_cart_total_price(self):
@@ -28,6 +56,21 @@ class TestCart(unittest.TestCase):
         cart = Cart()
         self.assertEqual(cart.total_price_cents(), 0)
 
+    def test_cart_merges_lines_and_keeps_running_total(self):
+        cart = Cart()
+        shirt = Shirt("SHIRT-RED-M", 2500, "M", "Red")
+        cart.add_item(shirt, 2)
+        cart.add_item(shirt, 1)
+        cart.add_line("MUG-WHITE-12", 1200)
+        self.assertEqual(len(cart), 2)
+        self.assertEqual(cart.items, [(shirt, 3), (None, 1)])
+        self.assertEqual(cart.total_price_cents(), 2500 * 3 + 1200)
+        cart.set_quantity("SHIRT-RED-M", 1)
+        self.assertEqual(cart.total_price_cents(), 2500 + 1200)
+        cart.remove_item("MUG-WHITE-12")
+        self.assertEqual(cart.total_price_cents(), 2500)
+        self.assertEqual(list(cart), [{"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 1}])
+
 
 class TestLoyaltyProgram(unittest.TestCase):
 
@@ -41,6 +84,348 @@ class TestLoyaltyProgram(unittest.TestCase):
         self.assertEqual(earned, 100)  
         self.assertEqual(c.points, 100)
 
+    def test_apply_points_bulk_uses_tier_strategy_once(self):
+        program = LoyaltyProgram(GoldReward())
+        bronze = Customer(1, "M001", "Alice", "Bronze", 0)
+        platinum = Customer(2, "M002", "Bob", "Platinum", 10)
+        program.add_customer(bronze)
+        program.add_customer(platinum)
+        program.add_order(Order(1, "O1", "M001", "Delivered", 5099))
+        program.add_order(Order(2, "O2", "M002", "Delivered", 1000))
+        program.add_order(Order(3, "O3", "M002", "Delivered", 250))
+        program.apply_points("O1")
+        self.assertEqual(bronze.points, 100)
+        self.assertEqual(program.apply_points_bulk(), {"M002": 30 + 6})
+        self.assertEqual(platinum.points, 46)
+        self.assertEqual(program.apply_points_bulk(), {})
+        self.assertEqual((bronze.points, platinum.points), (100, 46))
+
+    def test_apply_points_bulk_honours_overridden_calculate(self):
+        class FlatFive(GoldReward):
+            def calculate(self, order):
+                return 500
+
+        program = LoyaltyProgram(FlatFive(), tier_strategies={})
+        gold = Customer(1, "M001", "Alice", "Gold", 0)
+        program.add_customer(gold)
+        program.add_order(Order(1, "O1", "M001", "Delivered", 1000))
+        program.add_order(Order(2, "O2", "M001", "Delivered", 1000))
+        self.assertEqual(program.apply_points_bulk(), {"M001": 1000})
+        self.assertIsNone(FlatFive().flat_multiplier())
+        self.assertEqual(GoldReward().flat_multiplier(), 2)
+
+    def test_apply_points_bulk_credits_nothing_when_a_customer_is_missing(self):
+        program = LoyaltyProgram(GoldReward())
+        gold = Customer(1, "M001", "Alice", "Gold", 0)
+        program.add_customer(gold)
+        program.add_order(Order(1, "O1", "M001", "Delivered", 1000))
+        program.add_order(Order(2, "O2", "M404", "Delivered", 1000))
+        with self.assertRaises(KeyError):
+            program.apply_points_bulk()
+        self.assertEqual((gold.points, program.credited), (0, set()))
+        self.assertEqual(program.apply_points_bulk(["O1", "O1"]), {"M001": 20})
+        self.assertEqual(program.credited, {"O1"})
+
+
+class TestMovementLog(unittest.TestCase):
+
+    def test_running_stock_per_sku(self):
+        log = MovementLog([{"sku": "SHIRT-RED-M", "qty_change": 10}])
+        log.append({"sku": "SHIRT-RED-M", "qty_change": -3})
+        log.append({"sku": "MUG-WHITE-12", "qty_change": 4})
+        self.assertEqual(log.on_hand("SHIRT-RED-M"), 7)
+        self.assertEqual(log.on_hand("MUG-WHITE-12"), 4)
+        self.assertEqual(log.on_hand("UNKNOWN"), 0)
+        self.assertEqual(len(log), 3)
+
+    def test_point_in_time_stock(self):
+        log = MovementLog([{"sku": "SHIRT-RED-M", "qty_change": 10, "snapshot": True, "ts": 50.0},
+                           {"sku": "SHIRT-RED-M", "qty_change": -3, "ts": 100.0},
+                           {"sku": "MUG-WHITE-12", "qty_change": 4, "ts": 150.0},
+                           {"sku": "SHIRT-RED-M", "qty_change": -2, "ts": 200.0}])
+        with self.assertRaises(ValueError):
+            log.stock_at("SHIRT-RED-M", 0)
+        self.assertEqual([log.stock_at("SHIRT-RED-M", n) for n in range(1, 5)], [10, 7, 7, 5])
+        self.assertEqual(log.stock_at("MUG-WHITE-12", 2), 0)
+        self.assertEqual(log.stock_at("UNKNOWN", 4), 0)
+        self.assertEqual(log.stock_at_time("SHIRT-RED-M", 50.0), 10)
+        with self.assertRaises(ValueError):
+            log.stock_at_time("SHIRT-RED-M", 49.0)
+        self.assertEqual(log.stock_at_time("SHIRT-RED-M", 199.9), 7)
+        self.assertEqual(log.stock_at_time("SHIRT-RED-M", 200.0), 5)
+        self.assertEqual(log.net_change("SHIRT-RED-M", 1, 4), -5)
+        log.pop(1)
+        self.assertEqual([log.stock_at("SHIRT-RED-M", n) for n in range(1, 5)], [10, 10, 10, 8])
+
+    def test_repeat_and_reorder_rebuild_derived_state(self):
+        log = MovementLog([{"sku": "SHIRT-RED-M", "qty_change": 3},
+                           {"sku": "SHIRT-RED-M", "qty_change": -1}])
+        log *= 2
+        self.assertEqual((len(log), log.on_hand("SHIRT-RED-M")), (4, 4))
+        history = [log.stock_at("SHIRT-RED-M", n) for n in range(3)]
+        log.sort(key=lambda m: m["qty_change"])
+        self.assertEqual([m["qty_change"] for m in log], [-1, -1, 3, 3])
+        self.assertEqual([log.stock_at("SHIRT-RED-M", n) for n in range(3)], history)
+        log.reverse()
+        self.assertEqual([log.stock_at("SHIRT-RED-M", n) for n in range(3)], history)
+        self.assertEqual(log.on_hand("SHIRT-RED-M"), 4)
+        items = store_system.IndexedList([{"id": 1, "v": "a"}, {"id": 1, "v": "b"}], key=lambda r: r["id"])
+        items.reverse()
+        self.assertEqual(items.get(1)["v"], "b")
+
+    def test_compacted_history_rejects_older_time_queries(self):
+        log = MovementLog([{"sku": "SHIRT-RED-M", "qty_change": 10, "ts": 100.0},
+                           {"sku": "SHIRT-RED-M", "qty_change": -3, "ts": 200.0},
+                           {"sku": "SHIRT-RED-M", "qty_change": -1, "ts": 300.0}])
+        log.compact(keep=1)
+        self.assertEqual(log.stock_at_time("SHIRT-RED-M", 250.0), 7)
+        self.assertEqual(log.stock_at_time("SHIRT-RED-M", 300.0), 6)
+        with self.assertRaises(ValueError):
+            log.stock_at_time("SHIRT-RED-M", 150.0)
+        self.assertEqual(log.stock_at("SHIRT-RED-M", 2), 7)
+        self.assertEqual(log.net_change("SHIRT-RED-M", 2, 3), -1)
+        with self.assertRaises(ValueError):
+            log.stock_at("SHIRT-RED-M", 1)
+        log.append({"sku": "SHIRT-RED-M", "qty_change": 5})
+        self.assertEqual([m["seq"] for m in log], [1, 2, 3])
+        with self.assertRaises(ValueError):
+            MovementLog([{"sku": "SHIRT-RED-M", "qty_change": 7, "snapshot": True}]).stock_at_time("SHIRT-RED-M", 1.0)
+
+    def test_concurrent_appends_keep_positions_in_step(self):
+        log = MovementLog()
+        skus = [f"SKU-{i}" for i in range(8)]
+        workers = [threading.Thread(target=lambda sku=sku: [log.append({"sku": sku, "qty_change": 1})
+                                                            for _ in range(2000)]) for sku in skus]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        for sku in skus:
+            self.assertTrue(all(log[p]["sku"] == sku for p in log.positions[sku]))
+
+    def test_compaction_never_lets_a_removal_oversell(self):
+        log = MovementLog([{"sku": "A", "qty_change": 5}] + [{"sku": "B", "qty_change": 1}] * 5000 +
+                          [{"sku": "A", "qty_change": -4}])
+        stop = threading.Event()
+
+        def compact():
+            while not stop.is_set():
+                log.compact(keep=99999)
+
+        worker = threading.Thread(target=compact)
+        worker.start()
+        try:
+            for _ in range(200):
+                log.remove_many({"A": 2})
+        finally:
+            stop.set()
+            worker.join()
+        self.assertEqual(log.on_hand("A"), 1)
+
+    def test_removing_rows_recounts(self):
+        log = MovementLog([{"sku": "SHIRT-RED-M", "qty_change": 10}])
+        log.append({"sku": "SHIRT-RED-M", "qty_change": -3})
+        log.pop()
+        self.assertEqual(log.on_hand("SHIRT-RED-M"), 10)
+        log.clear()
+        self.assertEqual(log.on_hand("SHIRT-RED-M"), 0)
+
+    def test_compact_keeps_stock_and_tail(self):
+        log = MovementLog([{"sku": "SHIRT-RED-M", "qty_change": 10}, {"sku": "MUG-WHITE-12", "qty_change": 2}])
+        log.append({"sku": "SHIRT-RED-M", "qty_change": -3})
+        log.append({"sku": "MUG-WHITE-12", "qty_change": -2})
+        log.append({"sku": "SHIRT-RED-M", "qty_change": -1})
+        folded = log.compact(keep=1)
+        self.assertEqual(len(folded), 4)
+        self.assertEqual(list(log), [{"sku": "SHIRT-RED-M", "qty_change": 7, "snapshot": True, "ts": 0.0, "seq": 3},
+                                     {"sku": "SHIRT-RED-M", "qty_change": -1, "seq": 4}])
+        self.assertEqual(log.on_hand("SHIRT-RED-M"), 6)
+        self.assertEqual(log.on_hand("MUG-WHITE-12"), 0)
+
+    def test_remove_many_is_all_or_nothing(self):
+        log = MovementLog([{"sku": "SHIRT-RED-M", "qty_change": 3}, {"sku": "MUG-WHITE-12", "qty_change": 1}])
+        self.assertEqual(log.remove_many({"SHIRT-RED-M": 2, "MUG-WHITE-12": 2}), "MUG-WHITE-12")
+        self.assertEqual(log.on_hand("SHIRT-RED-M"), 3)
+        self.assertIsNone(log.remove_many({"SHIRT-RED-M": 2, "MUG-WHITE-12": 1}))
+        self.assertEqual((log.on_hand("SHIRT-RED-M"), log.on_hand("MUG-WHITE-12")), (1, 0))
+
+    def test_concurrent_removals_never_oversell(self):
+        log = MovementLog([{"sku": "SHIRT-RED-M", "qty_change": 500}])
+        sold = []
+
+        def register():
+            for _ in range(100):
+                if log.remove_many({"SHIRT-RED-M": 1}) is None:
+                    sold.append(1)
+
+        threads = [threading.Thread(target=register) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(sold), 500)
+        self.assertEqual(log.on_hand("SHIRT-RED-M"), 0)
+
+
+class TestIdAllocator(unittest.TestCase):
+
+    def test_concurrent_ids_are_unique(self):
+        rows = []
+        ids = IdAllocator(rows)
+
+        def writer():
+            for _ in range(200):
+                ids.append(lambda new_id: {"id": new_id})
+            ids.extend(range(3), lambda new_id, _: {"id": new_id})
+
+        threads = [threading.Thread(target=writer) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(r["id"] for r in rows), list(range(1, 8 * 203 + 1)))
+
+
+class TestMovementColumns(unittest.TestCase):
+
+    def test_rows_and_totals(self):
+        store = MovementColumns([{"sku": "SHIRT-RED-M", "qty_change": 10},
+                                 {"sku": "MUG-WHITE-12", "qty_change": 4}])
+        store.append("SHIRT-RED-M", -3)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.sku_codes, ["SHIRT-RED-M", "MUG-WHITE-12"])
+        row = store[-1]
+        self.assertEqual((row.id, row.sku, row.qty_change), (3, "SHIRT-RED-M", -3))
+        self.assertEqual(str(row), "Removed 3 units of SHIRT-RED-M")
+        self.assertEqual(store.totals(), {"SHIRT-RED-M": 7, "MUG-WHITE-12": 4})
+        self.assertEqual(store.on_hand("SHIRT-RED-M"), 7)
+        self.assertEqual(store.on_hand("UNKNOWN"), 0)
+
+
+class TestBinaryMovementFile(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "inventory.bin")
+
+    def test_totals_survive_reopen(self):
+        with BinaryMovementFile(self.path) as movements:
+            movements.extend([{"sku": "SHIRT-RED-M", "qty_change": 10, "ts": 1.5},
+                              {"sku": "MUG-WHITE-12", "qty_change": 4}])
+            movements.append("SHIRT-RED-M", -3)
+        reopened = BinaryMovementFile(self.path)
+        self.assertEqual(len(reopened), 3)
+        self.assertEqual(reopened.totals(), {"SHIRT-RED-M": 7, "MUG-WHITE-12": 4})
+        self.assertEqual(next(iter(reopened)), {"sku": "SHIRT-RED-M", "qty_change": 10, "ts": 1.5})
+        latest = max(m["ts"] for m in reopened)
+        self.assertEqual(reopened.snapshot_rows()[0],
+                         {"sku": "SHIRT-RED-M", "qty_change": 7, "snapshot": True, "ts": latest})
+        seeded = MovementLog(reopened.snapshot_rows())
+        self.assertEqual(seeded.stock_at_time("MUG-WHITE-12", latest), 4)
+
+    def test_torn_record_is_ignored(self):
+        with BinaryMovementFile(self.path) as movements:
+            movements.append("SHIRT-RED-M", 5)
+        with open(self.path, "ab") as f:
+            f.write(b"\x00\x00\x00")
+        self.assertEqual(BinaryMovementFile(self.path).totals(), {"SHIRT-RED-M": 5})
+        self.assertEqual(BinaryMovementFile(os.path.join(os.path.dirname(self.path), "none.bin")).totals(), {})
+
+    def test_writers_and_readers_share_sku_ids(self):
+        first, second = BinaryMovementFile(self.path), BinaryMovementFile(self.path)
+        reader = BinaryMovementFile(self.path)
+        self.addCleanup(first.close)
+        self.addCleanup(second.close)
+        first.append("SHIRT-RED-M", 12)
+        second.append("SHIRT-BLUE-L", 3)
+        first.append("SHIRT-BLUE-L", -1)
+        self.assertEqual(reader.totals(), {"SHIRT-RED-M": 12, "SHIRT-BLUE-L": 2})
+        self.assertEqual(BinaryMovementFile(self.path).totals(), {"SHIRT-RED-M": 12, "SHIRT-BLUE-L": 2})
+        self.assertEqual([m["sku"] for m in reader], ["SHIRT-RED-M", "SHIRT-BLUE-L", "SHIRT-BLUE-L"])
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_percentiles_within_one_bucket(self):
+        histogram = LatencyHistogram()
+        for ms in range(1, 101):
+            histogram.record(ms / 1000)
+        stats = histogram.snapshot()
+        self.assertEqual(stats["count"], 100)
+        self.assertAlmostEqual(stats["mean_ms"], 50.5)
+        self.assertTrue(50 <= stats["p50_ms"] < 50 * 1.2)
+        self.assertTrue(99 <= stats["p99_ms"] <= 100)
+        self.assertEqual(stats["max_ms"], 100)
+
+
+class TestSalesAnalytics(unittest.TestCase):
+
+    def test_summarize_groups_by_sku_member_tier_and_status(self):
+        variants = {"SHIRT-RED-M": {"price_cents": 2500}, "MUG-WHITE-12": {"price_cents": 1200}}
+        customers = {"CUST123": {"tier": "GOLD"}, "CUST456": {"tier": "SILVER"}}
+        orders = [
+            {"id": 1, "member_id": "CUST123", "status": "PAID", "total_cents": 5670},
+            {"id": 2, "member_id": None, "status": "PAID", "total_cents": 2500},
+            {"id": 3, "member_id": "CUST123", "status": "RETURN", "total_cents": 1200},
+        ]
+        items = [
+            {"order_id": 1, "sku": "SHIRT-RED-M", "qty": 2},
+            {"order_id": 1, "sku": "MUG-WHITE-12", "qty": 1},
+            {"order_id": 2, "sku": "SHIRT-RED-M", "qty": 1},
+            {"order_id": 3, "sku": "MUG-WHITE-12", "qty": 1},
+            {"order_id": 99, "sku": "MUG-WHITE-12", "qty": 5},
+        ]
+        report = analytics.summarize(orders, items, customers, variants)
+        self.assertEqual(report["net_revenue_cents"], 5670 + 2500 - 1200)
+        self.assertEqual(report["item_count"], 4)
+        self.assertEqual(report["by_sku"]["SHIRT-RED-M"],
+                         {"units_sold": 3, "revenue_cents": 7500, "units_returned": 0})
+        self.assertEqual(report["by_sku"]["MUG-WHITE-12"]["units_returned"], 1)
+        self.assertEqual(report["by_member"]["CUST123"],
+                         {"orders": 1, "revenue_cents": 5670, "refunds_cents": 1200})
+        self.assertEqual(report["by_tier"]["GUEST"]["revenue_cents"], 2500)
+        self.assertEqual(report["by_status"]["RETURN"], {"orders": 1, "total_cents": 1200, "units": 1})
+        self.assertEqual([s["sku"] for s in report["top_sellers"]], ["SHIRT-RED-M", "MUG-WHITE-12"])
+
+
+class TestPromotionEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.catalog = {
+            "SHIRT-RED-M": {"price_cents": 2500, "category": "shirts"},
+            "SHIRT-BLUE-L": {"price_cents": 2700, "category": "shirts"},
+            "MUG-WHITE-12": {"price_cents": 1200, "category": "mugs"},
+        }
+        self.engine = PromotionEngine([
+            TierDiscount("GOLD", 0.10),
+            CategoryMarkdown("shirts", 10),
+            SkuMarkdown("SHIRT-BLUE-L", percent=20),
+            BundleDeal("shirt + mug", {"SHIRT-RED-M": 1, "MUG-WHITE-12": 1}, 3000),
+        ], self.catalog)
+
+    def test_markdowns_bundles_and_tier_in_one_pass(self):
+        cart = [{"sku": "SHIRT-RED-M", "price_cents": 2500, "qty": 2},
+                {"sku": "SHIRT-BLUE-L", "price_cents": 2700, "qty": 1},
+                {"sku": "MUG-WHITE-12", "price_cents": 1200, "qty": 1}]
+        result = self.engine.evaluate(cart, "GOLD")
+        self.assertEqual(result["subtotal_cents"], 8900)
+        self.assertEqual(result["markdown_cents"], 250 * 2 + 540)
+        self.assertEqual(result["bundle_cents"], 2250 + 1200 - 3000)
+        self.assertEqual(result["tier_discount_cents"], round((8900 - 1040 - 450) * 0.10))
+        self.assertEqual(result["total_cents"], 8900 - 1040 - 450 - 741)
+
+    def test_results_are_memoized_per_tier_and_cart(self):
+        cart = [{"sku": "MUG-WHITE-12", "price_cents": 1200, "qty": 1}]
+        self.assertEqual(self.engine.evaluate_batch([(cart, None), (cart, "GOLD"), (cart, "GOLD")]),
+                         [self.engine.evaluate(cart, None)] + [self.engine.evaluate(cart, "GOLD")] * 2)
+        self.assertEqual(len(self.engine.cache), 2)
+
+    def test_default_rules_match_loyalty_discount(self):
+        engine = PromotionEngine(product_variants=self.catalog)
+        cart = [{"sku": "SHIRT-BLUE-L", "price_cents": 2700, "qty": 1}]
+        self.assertEqual(engine.evaluate(cart, "SILVER")["total_cents"], 2565)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,255 @@
+import argparse
+import os
+import re
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+# ============================
+# EV DATABASE ON SQLITE
+# ============================
+# Loads the MySQL dump in database_script into a local SQLite file so the
+# views can be queried without a MySQL server:
+#
+#   python ev_sqlite.py                       # build ev_db.sqlite, list views
+#   python ev_sqlite.py most_expensive_ev     # run one view
+#
+# The whole load is one transaction into a temporary file that replaces the
+# database when it commits. Rows go in with executemany before any index
+# exists; primary keys and KEY clauses become indexes once the data is in.
+# The database is only rebuilt when the dump is newer than it.
+
+DUMP = Path(__file__).with_name("database_script")
+DATABASE = Path(__file__).with_name("ev_db.sqlite")
+
+# is_cafv_eligable only exists in the views file, where it is missing commas
+# and a GROUP BY (MySQL never created it, so the dump has no definition)
+EXTRA_VIEWS = {
+    "is_cafv_eligable": """
+        SELECT car_make, model_type,
+               COUNT(vin_number) AS total_vehicles,
+               MIN(electric_range) AS min_range,
+               MAX(electric_range) AS max_range,
+               AVG(electric_range) AS avg_range
+        FROM cars
+        JOIN make USING (make_id)
+        JOIN model USING (model_id)
+        JOIN cafv USING (cafv_id)
+        WHERE cafv_id = 1
+        GROUP BY car_make, model_type
+    """,
+}
+
+_results = {}
+
+
+# split_statements(text) -> list of SQL statements
+def split_statements(text):
+    """Split a dump on semicolons outside quotes, dropping -- comment lines."""
+    statements = []
+    parts = []
+    start = 0
+    quote = None
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            if ch == "\\" and quote == "'":
+                i += 1
+            elif ch == quote:
+                quote = None
+        elif ch in "'`\"":
+            quote = ch
+        elif ch == "-" and text[i:i + 3] in ("-- ", "--\n") and (i == 0 or text[i - 1] == "\n"):
+            parts.append(text[start:i])
+            end = text.find("\n", i)
+            i = start = len(text) if end < 0 else end
+            continue
+        elif ch == ";":
+            statement = "".join(parts + [text[start:i]]).strip()
+            if statement:
+                statements.append(statement)
+            parts = []
+            start = i + 1
+        i += 1
+    statement = "".join(parts + [text[start:]]).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+_ESCAPES = {"0": "\0", "n": "\n", "r": "\r", "t": "\t", "Z": "\x1a", "b": "\b"}
+_TOKEN = re.compile(r"\s*(?:'((?:[^'\\]|\\.|'')*)'|(NULL)|([-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?))\s*([,)])", re.S)
+
+
+def _unescape(text):
+    text = text.replace("''", "'")
+    if "\\" not in text:
+        return text
+    return re.sub(r"\\(.)", lambda m: _ESCAPES.get(m.group(1), m.group(1)), text, flags=re.S)
+
+
+# parse_values(sql) -> rows of an INSERT ... VALUES (...),(...) list
+def parse_values(sql):
+    rows = []
+    pos = 0
+    while True:
+        pos = sql.index("(", pos) + 1
+        row = []
+        while True:
+            match = _TOKEN.match(sql, pos)
+            if match is None:
+                raise ValueError(f"Cannot parse value near {sql[pos:pos + 40]!r}")
+            text, null, number, end = match.groups()
+            if text is not None:
+                row.append(_unescape(text))
+            elif null:
+                row.append(None)
+            elif "." in number or "e" in number.lower():
+                row.append(float(number))
+            else:
+                row.append(int(number))
+            pos = match.end()
+            if end == ")":
+                break
+        rows.append(tuple(row))
+        rest = sql[pos:].lstrip()
+        if not rest.startswith(","):
+            return rows
+        pos = len(sql) - len(rest) + 1
+
+
+def _columns(cols):
+    return ", ".join(f'"{c.strip().strip("`")}"' for c in cols.split(","))
+
+
+# translate_table(sql) -> (create statement, index statements)
+def translate_table(sql):
+    """Turn a MySQL CREATE TABLE into SQLite DDL, moving keys into indexes."""
+    name = re.match(r"CREATE TABLE `(\w+)`", sql).group(1)
+    body = sql[sql.index("(") + 1:sql.rindex(")")]
+    columns = []
+    indexes = []
+    for line in body.split("\n"):
+        line = line.strip().rstrip(",")
+        if not line:
+            continue
+        key = re.match(r"(PRIMARY|UNIQUE)?\s*KEY\s*(?:`(\w+)`\s*)?\((.*)\)$", line)
+        if key:
+            kind, key_name, cols = key.groups()
+            unique = "UNIQUE " if kind else ""
+            index_name = f"{name}_pk" if kind == "PRIMARY" else f"{name}_{key_name}"
+            indexes.append(f'CREATE {unique}INDEX "{index_name}" ON "{name}" ({_columns(cols)})')
+            continue
+        line = re.sub(r"\b(AUTO_INCREMENT|unsigned)\b|\b(CHARACTER SET|COLLATE)\s+\w+", "", line)
+        columns.append(line.replace("`", '"'))
+    return f'CREATE TABLE "{name}" (\n  ' + ",\n  ".join(columns) + "\n)", indexes
+
+
+def _view(statement):
+    # Final view definitions look like
+    # /*!50001 CREATE ALGORITHM=... */ /*!50013 DEFINER=... */ /*!50001 VIEW `name` AS select ... */
+    if "CREATE ALGORITHM" not in statement:
+        return None
+    match = re.search(r"VIEW `(\w+)` AS (.*?)\s*\*/\s*$", statement, re.S)
+    return match.groups() if match else None
+
+
+# load_dump(db_path, dump_path) -> Path
+def load_dump(db_path=DATABASE, dump_path=DUMP):
+    """Rebuild the SQLite database from the dump in one transaction."""
+    db_path = Path(db_path)
+    building = db_path.with_name(db_path.name + ".building")
+    building.unlink(missing_ok=True)
+    statements = split_statements(Path(dump_path).read_text(encoding="utf-8"))
+
+    db = sqlite3.connect(building, isolation_level=None)
+    try:
+        db.execute("PRAGMA journal_mode=OFF")
+        db.execute("PRAGMA synchronous=OFF")
+        db.execute("BEGIN")
+        indexes = []
+        views = {}
+        for statement in statements:
+            if statement.startswith("CREATE TABLE"):
+                create, table_indexes = translate_table(statement)
+                db.execute(create)
+                indexes.extend(table_indexes)
+            elif statement.startswith("INSERT INTO"):
+                table = re.match(r"INSERT INTO `(\w+)`", statement).group(1)
+                rows = parse_values(statement[statement.index(" VALUES") + 7:])
+                if rows:
+                    placeholders = ", ".join("?" * len(rows[0]))
+                    db.executemany(f'INSERT INTO "{table}" VALUES ({placeholders})', rows)
+            else:
+                view = _view(statement)
+                if view:
+                    views[view[0]] = view[1]
+        for index in indexes:
+            db.execute(index)
+        views.update(EXTRA_VIEWS)
+        for name, select in views.items():
+            db.execute(f'CREATE VIEW "{name}" AS {select}')
+        db.execute("COMMIT")
+    except BaseException:
+        db.close()
+        building.unlink(missing_ok=True)
+        raise
+    db.close()
+    os.replace(building, db_path)
+    return db_path
+
+
+# ensure_database(db_path, dump_path, rebuild) -> Path
+def ensure_database(db_path=DATABASE, dump_path=DUMP, rebuild=False):
+    db_path = Path(db_path)
+    if rebuild or not db_path.exists() or db_path.stat().st_mtime_ns < Path(dump_path).stat().st_mtime_ns:
+        load_dump(db_path, dump_path)
+    return db_path
+
+
+def list_views(db_path=DATABASE):
+    with closing(sqlite3.connect(db_path)) as db:
+        return [name for name, in db.execute("SELECT name FROM sqlite_master WHERE type = 'view' ORDER BY name")]
+
+
+# run_view(name, db_path) -> (columns, rows)
+def run_view(name, db_path=DATABASE):
+    """Query a view; results are cached until the database file changes."""
+    db_path = Path(db_path)
+    key = (str(db_path.resolve()), db_path.stat().st_mtime_ns, name)
+    result = _results.get(key)
+    if result is None:
+        if name not in list_views(db_path):
+            raise ValueError(f"Unknown view: {name}")
+        with closing(sqlite3.connect(db_path)) as db:
+            cursor = db.execute(f'SELECT * FROM "{name}"')
+            result = ([c[0] for c in cursor.description], cursor.fetchall())
+        _results[key] = result
+    return result
+
+
+def print_result(columns, rows):
+    print("\t".join(columns))
+    for row in rows:
+        print("\t".join("" if v is None else str(v) for v in row))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load the EV database dump into SQLite and run its views.")
+    parser.add_argument("views", nargs="*", help="views to run; lists the views when omitted")
+    parser.add_argument("--db", default=DATABASE, help="SQLite database file")
+    parser.add_argument("--dump", default=DUMP, help="MySQL dump to load")
+    parser.add_argument("--rebuild", action="store_true", help="reload even if the database is up to date")
+    args = parser.parse_args(argv)
+
+    db_path = ensure_database(args.db, args.dump, args.rebuild)
+    if not args.views:
+        print("\n".join(list_views(db_path)))
+    for name in args.views:
+        print_result(*run_view(name, db_path))
+        print()
+
+
+if __name__ == "__main__":
+    main()
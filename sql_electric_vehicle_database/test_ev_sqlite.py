@@ -0,0 +1,36 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import ev_sqlite
+
+
+class TestEvSqlite(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db = ev_sqlite.ensure_database(Path(tmp.name) / "ev.sqlite")
+
+    def test_loads_every_table_and_view(self):
+        self.assertEqual(ev_sqlite.list_views(self.db), ["avg_msrp_by_ev_type", "ev_type_statistic",
+                                                         "evs_with_range_above_200", "is_cafv_eligable",
+                                                         "most_expensive_ev", "total_evs_in_wa"])
+        columns, rows = ev_sqlite.run_view("most_expensive_ev", self.db)
+        self.assertEqual(columns, ["car_make", "vin_number", "base_msrp"])
+        self.assertEqual(rows, [("FISKER", "YH4K14AA6C", 102000)])
+        self.assertIs(ev_sqlite.run_view("most_expensive_ev", self.db), ev_sqlite.run_view("most_expensive_ev", self.db))
+
+    def test_is_cafv_eligable_groups_by_make_and_model(self):
+        columns, rows = ev_sqlite.run_view("is_cafv_eligable", self.db)
+        self.assertEqual(columns, ["car_make", "model_type", "total_vehicles", "min_range", "max_range", "avg_range"])
+        self.assertIn(("TESLA", "MODEL 3", 1, 220, 220, 220.0), rows)
+
+    def test_parse_values_handles_escapes_and_nulls(self):
+        self.assertEqual(ev_sqlite.parse_values("(1,'O\\'Brien; Co',NULL),(-2,'a''b',1.5)"),
+                         [(1, "O'Brien; Co", None), (-2, "a'b", 1.5)])
+        self.assertEqual(ev_sqlite.split_statements("--\n-- note\nSELECT ';';\nSELECT 2;"), ["SELECT ';'", "SELECT 2"])
+
+
+if __name__ == "__main__":
+    unittest.main()